@@ -0,0 +1,388 @@
+"""
+Offline batch runner for large sweeps of orchestrator tasks.
+
+Reads tasks from a JSONL file ({"id": ..., "task": ..., "context": {...}}
+per line), runs them through AgentOrchestrator.execute_task with a bounded
+pool of workers and appends one JSON line per finished task to the output
+file. Tasks already completed in the output file are skipped, so an
+interrupted sweep picks up where it left off; failed ones are retried and
+their old entries removed.
+
+With a batch backend, the LLM calls of all in-flight tasks are collected
+into provider batch submissions (Anthropic Message Batches, OpenAI Batch
+API), which are cheaper than individual calls for work that can wait.
+
+Usage:
+    python agent_batch.py tasks.jsonl results.jsonl --backend batch --workers 256
+"""
+
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from agent_planner import AgentOrchestrator
+from agent_providers import (
+    AnthropicProvider,
+    Completion,
+    FakeProvider,
+    LLMProvider,
+    ProviderError,
+    aget_provider,
+    close_providers,
+)
+
+
+DEFAULT_WORKERS = 32
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_BATCH_WAIT = 5.0
+DEFAULT_POLL_INTERVAL = 30.0
+
+BatchRequest = Tuple[str, Dict[str, Any]]
+BatchOutcome = Union[Completion, Exception]
+
+
+class BatchBackend:
+    """Submits a list of (custom_id, params) requests and waits for all results."""
+
+    async def submit(self, requests: List[BatchRequest]) -> Dict[str, BatchOutcome]:
+        raise NotImplementedError
+
+
+class AnthropicBatchBackend(BatchBackend):
+    def __init__(self, api_key: str, base_url: Optional[str] = None, poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.poll_interval = poll_interval
+
+    async def submit(self, requests: List[BatchRequest]) -> Dict[str, BatchOutcome]:
+        client = (await aget_provider('anthropic', self.api_key, self.base_url)).client
+
+        entries = []
+        for custom_id, params in requests:
+            system, messages = AnthropicProvider._split_system(params['messages'])
+            body = {'model': params['model'], 'max_tokens': params['max_tokens'], 'messages': messages}
+            if system:
+                body['system'] = system
+            entries.append({'custom_id': custom_id, 'params': body})
+
+        batch = await client.messages.batches.create(requests=entries)
+        while batch.processing_status != 'ended':
+            await asyncio.sleep(self.poll_interval)
+            batch = await client.messages.batches.retrieve(batch.id)
+
+        outcomes: Dict[str, BatchOutcome] = {}
+        async for entry in await client.messages.batches.results(batch.id):
+            if entry.result.type == 'succeeded':
+                message = entry.result.message
+                outcomes[entry.custom_id] = Completion(
+                    text=''.join(block.text for block in message.content if block.type == 'text'),
+                    model=message.model,
+                    input_tokens=message.usage.input_tokens,
+                    output_tokens=message.usage.output_tokens
+                )
+            else:
+                outcomes[entry.custom_id] = ProviderError(f"Batch request {entry.result.type}")
+        return outcomes
+
+
+class OpenAIBatchBackend(BatchBackend):
+    def __init__(self, api_key: str, base_url: Optional[str] = None, poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.poll_interval = poll_interval
+
+    async def submit(self, requests: List[BatchRequest]) -> Dict[str, BatchOutcome]:
+        client = (await aget_provider('openai', self.api_key, self.base_url)).client
+
+        lines = [
+            json.dumps({
+                'custom_id': custom_id,
+                'method': 'POST',
+                'url': '/v1/chat/completions',
+                'body': params
+            })
+            for custom_id, params in requests
+        ]
+        upload = await client.files.create(
+            file=('batch.jsonl', io.BytesIO('\n'.join(lines).encode('utf-8'))),
+            purpose='batch'
+        )
+
+        batch = await client.batches.create(
+            input_file_id=upload.id,
+            endpoint='/v1/chat/completions',
+            completion_window='24h'
+        )
+        while batch.status not in ('completed', 'failed', 'expired', 'cancelled'):
+            await asyncio.sleep(self.poll_interval)
+            batch = await client.batches.retrieve(batch.id)
+
+        if batch.status != 'completed' or not batch.output_file_id:
+            raise ProviderError(f"OpenAI batch {batch.id} ended as {batch.status}")
+
+        outcomes: Dict[str, BatchOutcome] = {}
+        content = await client.files.content(batch.output_file_id)
+        for line in content.text.splitlines():
+            entry = json.loads(line)
+            response = entry.get('response') or {}
+            if response.get('status_code') == 200:
+                body = response['body']
+                usage = body.get('usage') or {}
+                outcomes[entry['custom_id']] = Completion(
+                    text=body['choices'][0]['message']['content'] or '',
+                    model=body['model'],
+                    input_tokens=usage.get('prompt_tokens', 0),
+                    output_tokens=usage.get('completion_tokens', 0)
+                )
+            else:
+                outcomes[entry['custom_id']] = ProviderError(f"Batch request failed: {entry.get('error')}")
+        return outcomes
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    Offline stand-in that answers a batch with an ordinary provider.
+
+    Defaults to FakeProvider, so sweeps can be exercised without network.
+    """
+
+    def __init__(self, provider: Optional[LLMProvider] = None):
+        self.provider = provider or FakeProvider()
+        self.batches: List[int] = []
+
+    async def submit(self, requests: List[BatchRequest]) -> Dict[str, BatchOutcome]:
+        self.batches.append(len(requests))
+        outcomes = await asyncio.gather(
+            *(self.provider.complete(**params) for _, params in requests),
+            return_exceptions=True
+        )
+        return {custom_id: outcome for (custom_id, _), outcome in zip(requests, outcomes)}
+
+
+class BatchingProvider(LLMProvider):
+    """
+    Provider that groups concurrent calls into batch submissions.
+
+    Calls wait until `max_batch_size` requests are queued or the oldest has
+    waited `max_wait` seconds, then go to the backend together.
+    """
+
+    name = 'batch'
+
+    def __init__(
+        self,
+        backend: BatchBackend,
+        max_batch_size: int = DEFAULT_BATCH_SIZE,
+        max_wait: float = DEFAULT_BATCH_WAIT
+    ):
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._ids = itertools.count()
+        self._pending: List[Tuple[str, Dict[str, Any], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._submissions: Set[asyncio.Task] = set()
+
+    async def complete(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int
+    ) -> Completion:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        params = {'model': model, 'messages': messages, 'max_tokens': max_tokens}
+        self._pending.append((f"req-{next(self._ids)}", params, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            submission = asyncio.create_task(self._submit(batch))
+            self._submissions.add(submission)
+            submission.add_done_callback(self._submissions.discard)
+
+    async def _submit(self, batch: List[Tuple[str, Dict[str, Any], asyncio.Future]]):
+        try:
+            outcomes = await self.backend.submit([(custom_id, params) for custom_id, params, _ in batch])
+        except Exception as e:
+            outcomes = {custom_id: e for custom_id, _, _ in batch}
+
+        for custom_id, _, future in batch:
+            if future.done():
+                continue
+            outcome = outcomes.get(custom_id, ProviderError(f"No batch result for {custom_id}"))
+            if isinstance(outcome, Exception):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+
+
+def read_tasks(path: Union[str, Path]) -> Iterator[Dict[str, Any]]:
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            entry.setdefault('id', str(line_number))
+            yield entry
+
+
+def prune_results(path: Union[str, Path]) -> Set[str]:
+    """
+    Rewrite the output file of earlier runs with one completed entry per
+    id and nothing else, and return those ids. Failed tasks run again and
+    are recorded anew, so each id keeps a single line.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+
+    pruned = f'{path}.tmp'
+    with open(path) as f, open(pruned, 'w') as out:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Torn last line from an interrupted run
+                continue
+            task_id = str(entry['id'])
+            if entry.get('status') == 'completed' and task_id not in done:
+                done.add(task_id)
+                out.write(line if line.endswith('\n') else line + '\n')
+    os.replace(pruned, path)
+    return done
+
+
+async def run_batch(
+    input_path: Union[str, Path],
+    output_path: Union[str, Path],
+    orchestrator: AgentOrchestrator,
+    workers: int = DEFAULT_WORKERS
+) -> Dict[str, int]:
+    """
+    Run every not-yet-completed task in input_path, appending results.
+
+    Failed entries of earlier runs are dropped from output_path first,
+    as their tasks are retried. Returns counts of completed, failed and
+    skipped tasks.
+    """
+    done = prune_results(output_path)
+    counts = {'completed': 0, 'failed': 0, 'skipped': 0}
+    queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+
+    with open(output_path, 'a') as out:
+        def record(entry: Dict[str, Any]):
+            out.write(json.dumps(entry) + '\n')
+            out.flush()
+            counts['completed' if entry['status'] == 'completed' else 'failed'] += 1
+
+        async def worker():
+            while True:
+                entry = await queue.get()
+                try:
+                    result = await orchestrator.execute_task(entry['task'], entry.get('context'))
+                    record({'id': entry['id'], 'status': result['status'], 'result': result})
+                except Exception as e:
+                    record({'id': entry['id'], 'status': 'failed', 'error': str(e)})
+                finally:
+                    queue.task_done()
+
+        pool = [asyncio.create_task(worker()) for _ in range(workers)]
+        try:
+            for entry in read_tasks(input_path):
+                if str(entry['id']) in done:
+                    counts['skipped'] += 1
+                    continue
+                await queue.put(entry)
+            await queue.join()
+        finally:
+            for task in pool:
+                task.cancel()
+            await asyncio.gather(*pool, return_exceptions=True)
+
+    return counts
+
+
+def build_orchestrator(
+    backend: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    batch_wait: float = DEFAULT_BATCH_WAIT,
+    config: Optional[Dict[str, Any]] = None
+) -> AgentOrchestrator:
+    """
+    Orchestrator wired for a sweep.
+
+    backend is 'direct' (regular calls, bounded only by the worker pool),
+    'batch' (provider batch APIs) or 'local' (offline stand-in batches).
+    """
+    config = dict(config or {})
+    for name, env in (('anthropic_key', 'ANTHROPIC_API_KEY'), ('openai_key', 'OPENAI_API_KEY')):
+        if os.environ.get(env):
+            config.setdefault(name, os.environ[env])
+
+    if backend != 'direct':
+        # Batched calls sit in the provider's queue, not on a connection,
+        # so let a whole batch be in flight at once
+        config.setdefault('rate_limits', {
+            'anthropic': {'max_concurrency': batch_size},
+            'openai': {'max_concurrency': batch_size},
+        })
+    orchestrator = AgentOrchestrator(config)
+
+    if backend == 'batch':
+        backends = {
+            'anthropic': AnthropicBatchBackend(orchestrator.anthropic_key, orchestrator.base_urls['anthropic']),
+            'openai': OpenAIBatchBackend(orchestrator.openai_key, orchestrator.base_urls['openai']),
+        }
+    elif backend == 'local':
+        backends = {'anthropic': LocalBatchBackend(), 'openai': LocalBatchBackend()}
+    else:
+        return orchestrator
+
+    for name, batch_backend in backends.items():
+        orchestrator.providers[name] = BatchingProvider(batch_backend, batch_size, batch_wait)
+    return orchestrator
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Run orchestrator tasks from a JSONL file.')
+    parser.add_argument('input', help='JSONL file with one {"id", "task", "context"} per line')
+    parser.add_argument('output', help='JSONL file results are appended to')
+    parser.add_argument('--backend', choices=['direct', 'batch', 'local'], default='direct')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--batch-wait', type=float, default=DEFAULT_BATCH_WAIT)
+    args = parser.parse_args(argv)
+
+    orchestrator = build_orchestrator(args.backend, args.batch_size, args.batch_wait)
+    try:
+        counts = await run_batch(args.input, args.output, orchestrator, args.workers)
+    finally:
+        await close_providers()
+
+    print(
+        f"completed={counts['completed']} failed={counts['failed']} skipped={counts['skipped']}",
+        file=sys.stderr
+    )
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,211 @@
+"""
+Content-addressed response cache for orchestrator LLM calls.
+
+Responses are keyed on a hash of (provider, model, messages, max_tokens)
+and kept in two tiers: a bounded in-memory LRU and an optional SQLite file
+that survives restarts. Disk hits are promoted back into memory.
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple, Union
+
+from agent_providers import Completion
+
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def cache_key(
+    provider: str,
+    model: str,
+    messages: List[Dict[str, str]],
+    max_tokens: int
+) -> str:
+    payload = json.dumps(
+        [provider, model, messages, max_tokens],
+        sort_keys=True,
+        separators=(',', ':')
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MemoryCache:
+    """LRU of completions bounded by entry count, approximate bytes and TTL."""
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttl: float = DEFAULT_TTL
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries: 'OrderedDict[str, Tuple[float, int, Completion]]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Completion]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, _, completion = entry
+        if expires_at < time.time():
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return completion
+
+    def set(self, key: str, completion: Completion, expires_at: Optional[float] = None):
+        if key in self._entries:
+            self._remove(key)
+
+        size = len(completion.text.encode('utf-8')) + len(key) + 64
+        if size > self.max_bytes:
+            return
+
+        self._entries[key] = (expires_at or time.time() + self.ttl, size, completion)
+        self.size += size
+
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+
+class SQLiteCache:
+    """
+    Persistent completion store in a local SQLite file.
+
+    Methods are blocking; ResponseCache runs them in a worker thread.
+    """
+
+    def __init__(self, path: Union[str, Path], ttl: float = DEFAULT_TTL):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[Completion, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires_at FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+
+        if row is None or row[1] < time.time():
+            return None
+
+        return Completion(**json.loads(row[0])), row[1]
+
+    def set(self, key: str, completion: Completion):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, json.dumps(asdict(completion)), time.time() + self.ttl)
+            )
+            self._conn.commit()
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                'DELETE FROM responses WHERE expires_at < ?', (time.time(),)
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """
+    Two-tier completion cache with hit/miss counters.
+
+    Args:
+        path: SQLite file for the persistent tier (memory only when None)
+        ttl: Seconds an entry stays valid in either tier
+        max_entries: Entry limit of the in-memory tier
+        max_bytes: Approximate size limit of the in-memory tier
+    """
+
+    def __init__(
+        self,
+        path: Optional[Union[str, Path]] = None,
+        ttl: float = DEFAULT_TTL,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES
+    ):
+        self.memory = MemoryCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
+        self.disk = SQLiteCache(path, ttl=ttl) if path else None
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'writes': 0}
+
+    @property
+    def hit_rate(self) -> float:
+        hits = self.stats['memory_hits'] + self.stats['disk_hits']
+        total = hits + self.stats['misses']
+        return hits / total if total else 0.0
+
+    async def get(self, key: str) -> Optional[Completion]:
+        completion = self.memory.get(key)
+        if completion is not None:
+            self.stats['memory_hits'] += 1
+            return completion
+
+        if self.disk is not None:
+            found = await asyncio.to_thread(self.disk.get, key)
+            if found is not None:
+                completion, expires_at = found
+                self.memory.set(key, completion, expires_at)
+                self.stats['disk_hits'] += 1
+                return completion
+
+        self.stats['misses'] += 1
+        return None
+
+    async def set(self, key: str, completion: Completion):
+        self.memory.set(key, completion)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, completion)
+        self.stats['writes'] += 1
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
@@ -0,0 +1,118 @@
+"""
+Durable checkpoints for orchestrator runs.
+
+Each execute_task run gets a run ID under which its task, context, plan
+and every step result are written to a local SQLite file as soon as they
+exist. AgentOrchestrator.resume(run_id) uses them to re-execute only the
+steps that did not complete.
+"""
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+
+class CheckpointStore:
+    """
+    SQLite-backed run checkpoints.
+
+    The blocking work runs in a worker thread; every write is committed
+    before the awaiting coroutine continues.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(
+            'CREATE TABLE IF NOT EXISTS runs ('
+            '  run_id TEXT PRIMARY KEY,'
+            '  task TEXT NOT NULL,'
+            '  context TEXT NOT NULL,'
+            '  plan TEXT,'
+            '  status TEXT NOT NULL,'
+            '  result TEXT,'
+            '  updated_at REAL NOT NULL'
+            ');'
+            'CREATE TABLE IF NOT EXISTS steps ('
+            '  run_id TEXT NOT NULL,'
+            '  step_id TEXT NOT NULL,'
+            '  status TEXT NOT NULL,'
+            '  result TEXT NOT NULL,'
+            '  PRIMARY KEY (run_id, step_id)'
+            ');'
+        )
+        self._conn.commit()
+
+    def _write(self, sql: str, params: tuple):
+        with self._lock:
+            self._conn.execute(sql, params)
+            self._conn.commit()
+
+    async def start_run(self, run_id: str, task: str, context: Dict):
+        await asyncio.to_thread(
+            self._write,
+            'INSERT OR IGNORE INTO runs (run_id, task, context, status, updated_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (run_id, task, json.dumps(context), 'in_progress', time.time())
+        )
+
+    async def save_plan(self, run_id: str, plan: Dict):
+        await asyncio.to_thread(
+            self._write,
+            'UPDATE runs SET plan = ?, updated_at = ? WHERE run_id = ?',
+            (json.dumps(plan), time.time(), run_id)
+        )
+
+    async def save_step(self, run_id: str, step_id: str, result: Dict):
+        await asyncio.to_thread(
+            self._write,
+            'INSERT OR REPLACE INTO steps (run_id, step_id, status, result) VALUES (?, ?, ?, ?)',
+            (run_id, step_id, result['status'], json.dumps(result))
+        )
+
+    async def finish_run(self, run_id: str, result: Dict):
+        await asyncio.to_thread(
+            self._write,
+            'UPDATE runs SET status = ?, result = ?, updated_at = ? WHERE run_id = ?',
+            (result['status'], json.dumps(result), time.time(), run_id)
+        )
+
+    def _load(self, run_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            run = self._conn.execute(
+                'SELECT task, context, plan, status, result FROM runs WHERE run_id = ?', (run_id,)
+            ).fetchone()
+            if run is None:
+                return None
+            steps = self._conn.execute(
+                'SELECT step_id, result FROM steps WHERE run_id = ?', (run_id,)
+            ).fetchall()
+
+        task, context, plan, status, result = run
+        return {
+            'run_id': run_id,
+            'task': task,
+            'context': json.loads(context),
+            'plan': json.loads(plan) if plan else None,
+            'status': status,
+            'result': json.loads(result) if result else None,
+            'steps': {step_id: json.loads(step) for step_id, step in steps}
+        }
+
+    async def load_run(self, run_id: str) -> Dict[str, Any]:
+        """Return the checkpointed run; raises KeyError for unknown IDs."""
+        run = await asyncio.to_thread(self._load, run_id)
+        if run is None:
+            raise KeyError(f"No checkpoint for run {run_id}")
+        return run
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,208 @@
+"""
+Token-budgeted rendering of previous step results into prompts.
+
+Appending every previous result verbatim makes each prompt larger than
+the last. ContextWindowManager keeps the newest results verbatim while
+they fit the budget and replaces older ones with short summaries, which
+are cached by content so each result is summarized at most once.
+"""
+
+import asyncio
+import hashlib
+import importlib
+import json
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+
+DEFAULT_CONTEXT_BUDGET = 4000
+DEFAULT_SUMMARY_TOKENS = 300
+
+# Rough characters per token when no tokenizer is available for a model
+CHARS_PER_TOKEN = {
+    'claude': 3.5,
+    'gpt': 4.0,
+}
+
+_encodings = {}
+_tiktoken: Any = None
+
+
+def _load_tiktoken():
+    """Import tiktoken on the first OpenAI count; False when not installed."""
+    global _tiktoken
+    if _tiktoken is None:
+        try:
+            _tiktoken = importlib.import_module('tiktoken')
+        except ImportError:
+            _tiktoken = False
+    return _tiktoken
+
+
+def count_tokens(text: str, model: str) -> int:
+    """
+    Count tokens of text for model.
+
+    Uses tiktoken for OpenAI models when it is installed and a per-family
+    characters-per-token estimate otherwise.
+    """
+    tiktoken = _load_tiktoken() if model.startswith('gpt') else None
+    if tiktoken:
+        if model not in _encodings:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding('cl100k_base')
+        return len(_encodings[model].encode(text))
+
+    ratio = next(
+        (chars for prefix, chars in CHARS_PER_TOKEN.items() if model.startswith(prefix)),
+        4.0
+    )
+    return int(len(text) / ratio) + 1
+
+
+def truncate_to_tokens(text: str, model: str, max_tokens: int) -> str:
+    if count_tokens(text, model) <= max_tokens:
+        return text
+
+    # Shrink proportionally, then trim until the count fits
+    text = text[:max(0, int(len(text) * max_tokens / count_tokens(text, model)))]
+    while text and count_tokens(text + '...', model) > max_tokens:
+        text = text[:int(len(text) * 0.9)]
+    return text + '...'
+
+
+def split_to_tokens(text: str, model: str, max_tokens: int) -> List[str]:
+    """
+    Cut text into consecutive pieces of at most max_tokens each, nothing
+    dropped. Cuts fall on a paragraph, line or word break when one is
+    in the second half of a piece.
+    """
+    pieces = []
+    while count_tokens(text, model) > max_tokens:
+        end = max(1, int(len(text) * max_tokens / count_tokens(text, model)))
+        while end > 1 and count_tokens(text[:end], model) > max_tokens:
+            end = int(end * 0.9)
+        for separator in ('\n\n', '\n', ' '):
+            cut = text.rfind(separator, 0, end)
+            if cut > end // 2:
+                end = cut + len(separator)
+                break
+        pieces.append(text[:end])
+        text = text[end:]
+    if text:
+        pieces.append(text)
+    return pieces
+
+
+class ContextWindowManager:
+    """
+    Render previous results within a per-prompt token budget.
+
+    Args:
+        summarize: Coroutine turning a result's text into a short summary;
+            render(use_cache=False) calls it with use_cache=False
+        budget: Token budget for the whole previous-results block
+        summary_tokens: Target size of each summary
+        max_summaries: Number of summaries kept in the in-process cache
+    """
+
+    def __init__(
+        self,
+        summarize: Callable[[str], Awaitable[str]],
+        budget: int = DEFAULT_CONTEXT_BUDGET,
+        summary_tokens: int = DEFAULT_SUMMARY_TOKENS,
+        max_summaries: int = 1024
+    ):
+        self.summarize = summarize
+        self.budget = budget
+        self.summary_tokens = summary_tokens
+        self.max_summaries = max_summaries
+        self._summaries: 'OrderedDict[str, str]' = OrderedDict()
+
+    @staticmethod
+    def _as_text(result: Any) -> str:
+        return result if isinstance(result, str) else json.dumps(result)
+
+    async def _summary(self, text: str, use_cache: bool = True) -> str:
+        if not use_cache:
+            return await self.summarize(text, use_cache=False)
+
+        key = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        if key in self._summaries:
+            self._summaries.move_to_end(key)
+            return self._summaries[key]
+
+        summary = await self.summarize(text)
+        self._summaries[key] = summary
+        if len(self._summaries) > self.max_summaries:
+            self._summaries.popitem(last=False)
+        return summary
+
+    async def render(
+        self,
+        previous_results: List[Any],
+        model: str,
+        budget: Optional[int] = None,
+        use_cache: bool = True
+    ) -> Tuple[str, int]:
+        """
+        Return the previous-results block for a prompt and its token count.
+
+        Results are taken newest first. Each one is kept verbatim while the
+        running total fits the budget. Older ones then fill whatever room
+        is left, newest first: as they are when short, otherwise
+        summarized. Only results expected to fit are summarized, and the
+        rest are just counted as omitted. With use_cache=False every
+        summary is made afresh.
+        """
+        budget = budget or self.budget
+        texts = [self._as_text(result) for result in previous_results]
+        tokens = [count_tokens(text, model) for text in texts]
+
+        verbatim: List[int] = []
+        used = 0
+        for i in reversed(range(len(texts))):
+            if used + tokens[i] > budget:
+                break
+            verbatim.append(i)
+            used += tokens[i]
+
+        kept = set(verbatim)
+        recent = '\n\n'.join(f"Result {i + 1}: {texts[i]}" for i in sorted(verbatim))
+        remaining = budget - count_tokens(recent, model)
+
+        # Older results, newest first, that should fit once summarized
+        older: List[int] = []
+        expected = 0
+        for i in reversed(range(len(texts))):
+            if i in kept:
+                continue
+            expected += min(tokens[i], self.summary_tokens)
+            if expected > remaining:
+                break
+            older.append(i)
+
+        summaries = await asyncio.gather(*(
+            self._summary(texts[i], use_cache) if tokens[i] > self.summary_tokens else asyncio.sleep(0, texts[i])
+            for i in older
+        ))
+
+        entries: List[str] = []
+        for i, summary in zip(older, summaries):
+            label = ' (summary)' if tokens[i] > self.summary_tokens else ''
+            entry = f"Result {i + 1}{label}: {summary}"
+            cost = count_tokens(entry, model)
+            if cost > remaining:
+                break
+            entries.append(entry)
+            remaining -= cost
+        entries.reverse()
+
+        omitted = len(texts) - len(verbatim) - len(entries)
+        if omitted:
+            entries.insert(0, f"({omitted} older results omitted)")
+
+        block = '\n\n'.join(entries + ([recent] if recent else []))
+        return block, count_tokens(block, model)
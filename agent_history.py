@@ -0,0 +1,246 @@
+"""
+Memory-bounded conversation history for the agent orchestrator.
+
+Records are slotted objects with float timestamps. Only the newest
+`max_entries` stay in memory; with a path, every record is also appended
+to a JSON-lines log, so older entries remain readable from disk and the
+history survives restarts. A sparse index (one file offset and timestamp
+per INDEX_INTERVAL records) makes paged and time-range reads seek straight
+to the right part of the log while keeping memory flat.
+"""
+
+import bisect
+import json
+import threading
+import time
+from array import array
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Union
+
+
+DEFAULT_HISTORY_ENTRIES = 1000
+INDEX_INTERVAL = 256
+
+Timestamp = Union[float, datetime, str]
+
+
+def _epoch(value: Optional[Timestamp]) -> Optional[float]:
+    if isinstance(value, str):
+        # ISO 8601, as HistoryRecord.to_dict writes it
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            # Naive datetimes are UTC, like the timestamps history hands out
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return value
+
+
+class HistoryRecord:
+    __slots__ = ('role', 'content', 'timestamp')
+
+    def __init__(self, role: str, content: str, timestamp: float):
+        self.role = role
+        self.content = content
+        self.timestamp = timestamp
+
+    def to_dict(self) -> Dict[str, str]:
+        """The dict form add_to_history has always produced (naive UTC ISO timestamp)."""
+        return {
+            'role': self.role,
+            'content': self.content,
+            'timestamp': datetime.fromtimestamp(self.timestamp, timezone.utc).replace(tzinfo=None).isoformat()
+        }
+
+    def to_json(self) -> str:
+        return json.dumps({'role': self.role, 'content': self.content, 'ts': self.timestamp})
+
+    @classmethod
+    def from_json(cls, line: Union[str, bytes]) -> 'HistoryRecord':
+        data = json.loads(line)
+        return cls(data['role'], data['content'], data['ts'])
+
+
+class HistoryStore:
+    """
+    Bounded in-memory ring with an optional append-only log behind it.
+
+    Positions are global: the first record ever added is 0, even after it
+    has left memory. Timestamps never go backwards, so time ranges can be
+    found by bisection. The log is only ever appended to; clear() moves it
+    aside and starts a new one.
+
+    Args:
+        path: JSON-lines log; existing entries are loaded on start
+        max_entries: Records kept in memory
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]] = None, max_entries: int = DEFAULT_HISTORY_ENTRIES):
+        self.path = Path(path) if path else None
+        self.max_entries = max_entries
+        self._ring: deque = deque(maxlen=max_entries)
+        self._count = 0
+        self._last_timestamp = 0.0
+        self._lock = threading.Lock()
+        # Offset and timestamp of every INDEX_INTERVAL-th record in the log
+        self._offsets = array('Q')
+        self._timestamps = array('d')
+        self._log = None
+
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._load()
+            self._log = open(self.path, 'ab')
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        offset = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                record = HistoryRecord.from_json(line)
+                self._index(record, offset)
+                self._ring.append(record)
+                offset += len(line)
+
+        # Drop a torn final write so the next append starts on a clean line
+        if offset < self.path.stat().st_size:
+            with open(self.path, 'r+b') as f:
+                f.truncate(offset)
+
+    def _index(self, record: HistoryRecord, offset: int):
+        if self.path is not None and self._count % INDEX_INTERVAL == 0:
+            self._offsets.append(offset)
+            self._timestamps.append(record.timestamp)
+        self._count += 1
+        self._last_timestamp = record.timestamp
+
+    def append(self, role: str, content: str, timestamp: Optional[Timestamp] = None) -> HistoryRecord:
+        """Add a record, stamped now unless `timestamp` is given."""
+        timestamp = _epoch(timestamp) if timestamp is not None else time.time()
+        with self._lock:
+            record = HistoryRecord(role, content, max(timestamp, self._last_timestamp))
+            if self._log is not None:
+                offset = self._log.tell()
+                self._log.write(record.to_json().encode() + b'\n')
+                self._log.flush()
+            else:
+                offset = 0
+            self._index(record, offset)
+            self._ring.append(record)
+            return record
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def first_position(self) -> int:
+        """Position of the oldest record still readable."""
+        return 0 if self.path is not None else self._count - len(self._ring)
+    
+    @property
+    def memory_position(self) -> int:
+        """Position of the oldest record still in memory."""
+        return self._count - len(self._ring)
+
+    def _read_log(self, start: int) -> Iterator[HistoryRecord]:
+        """Records from the log starting at position `start`."""
+        block = start // INDEX_INTERVAL
+        with open(self.path, 'rb') as f:
+            f.seek(self._offsets[block])
+            position = block * INDEX_INTERVAL
+            for line in f:
+                if position >= self._count:
+                    break
+                if position >= start:
+                    yield HistoryRecord.from_json(line)
+                position += 1
+
+    def _position_at(self, timestamp: float) -> int:
+        """Position of the first record at or after `timestamp`."""
+        ring_start = self._count - len(self._ring)
+        if self._ring and timestamp >= self._ring[0].timestamp:
+            timestamps = [record.timestamp for record in self._ring]
+            return ring_start + bisect.bisect_left(timestamps, timestamp)
+        if self.path is None:
+            return ring_start
+
+        block = max(0, bisect.bisect_left(self._timestamps, timestamp) - 1)
+        position = block * INDEX_INTERVAL
+        for record in self._read_log(position):
+            if record.timestamp >= timestamp:
+                break
+            position += 1
+        return position
+
+    def get(
+        self,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        since: Optional[Timestamp] = None,
+        until: Optional[Timestamp] = None
+    ) -> List[HistoryRecord]:
+        """
+        Return up to `limit` records from position `offset` on.
+
+        With `since` / `until` (epoch seconds, datetimes or ISO strings),
+        only records with since <= timestamp < until are considered and
+        `offset` counts from the first of them.
+        """
+        with self._lock:
+            start = max(self.first_position, offset)
+            if since is not None:
+                start = max(start, self._position_at(_epoch(since)) + offset)
+            end = self._count if limit is None else min(self._count, start + limit)
+            if until is not None:
+                end = min(end, self._position_at(_epoch(until)))
+            if start >= end:
+                return []
+
+            ring_start = self._count - len(self._ring)
+            records: List[HistoryRecord] = []
+            if start < ring_start:
+                for record in self._read_log(start):
+                    if start + len(records) >= min(end, ring_start):
+                        break
+                    records.append(record)
+            first = max(start, ring_start) - ring_start
+            for i in range(first, end - ring_start):
+                records.append(self._ring[i])
+            return records
+
+    def clear(self):
+        """
+        Start over with no records. A non-empty log is renamed to
+        <path>.<unix time> rather than truncated, and a new one is begun.
+        """
+        with self._lock:
+            self._ring.clear()
+            self._count = 0
+            self._last_timestamp = 0.0
+            self._offsets = array('Q')
+            self._timestamps = array('d')
+            if self._log is not None:
+                self._log.close()
+                if self.path.stat().st_size:
+                    self.path.rename(self._archive_path())
+                self._log = open(self.path, 'ab')
+
+    def _archive_path(self) -> Path:
+        stamp = int(time.time())
+        archive = self.path.with_name(f'{self.path.name}.{stamp}')
+        suffix = 1
+        while archive.exists():
+            archive = self.path.with_name(f'{self.path.name}.{stamp}-{suffix}')
+            suffix += 1
+        return archive
+
+    def close(self):
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
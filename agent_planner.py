@@ -1,14 +1,75 @@
-import anthropic
-import openai
 import asyncio
 import json
-from typing import List, Dict, Any, Optional
+import time
+import uuid
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, List, Dict, Any, Optional, Tuple
 from datetime import datetime
 
+from agent_cache import ResponseCache, cache_key
+from agent_checkpoint import CheckpointStore
+from agent_context import ContextWindowManager, DEFAULT_CONTEXT_BUDGET, count_tokens, split_to_tokens, truncate_to_tokens
+from agent_history import DEFAULT_HISTORY_ENTRIES, HistoryStore, Timestamp
+from agent_providers import Completion, LLMProvider, aget_provider, close_providers
+from agent_ratelimit import ProviderRateLimiter, RetryPolicy
+from agent_tracing import Tracer, estimate_cost
+
+
+CLAUDE_MODEL = 'claude-sonnet-4-20250514'
+GPT_MODEL = 'gpt-4-turbo'
+SUMMARY_MODEL = 'claude-3-5-haiku-20241022'
+
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_SYNTHESIS_CHUNK_TOKENS = 6000
+PARTIAL_SUMMARY_TOKENS = 1000
+
+# Provider each step action is sent to
+ACTION_PROVIDERS = {
+    'analyze': 'anthropic',
+    'generate': 'openai',
+    'research': 'anthropic',
+}
+
+
+class PlanError(ValueError):
+    """Raised when a plan's step dependencies cannot be scheduled."""
+
+
+Emit = Callable[[Dict[str, Any]], None]
+
+# (on_text, on_reset): on_reset is called before a call that already streamed
+# some text is retried, since the retry streams its text again from the start
+TokenSink = Tuple[Callable[[str], None], Callable[[], None]]
+
+# Set while a streaming run executes a step or the synthesis; provider calls
+# made under it stream their text here instead of returning it in one piece
+_token_sink: ContextVar[Optional[TokenSink]] = ContextVar('token_sink', default=None)
+
+
+def answer_key(output: str) -> str:
+    """
+    What a replica's output votes for in a quorum: the JSON value it holds
+    (bare or in a code fence), compared by value, or else its text with
+    case, spacing and a final full stop ignored.
+    """
+    text = output.strip()
+    if text.startswith('```'):
+        # Drop the fence and its language tag
+        text = text.strip('`').partition('\n')[2]
+    try:
+        return json.dumps(json.loads(text), sort_keys=True)
+    except ValueError:
+        return ' '.join(output.lower().split()).rstrip('.')
+
 
 class AgentOrchestrator:
     #old: "4fF6hH8kK0mM2nN4pP6qQ8rR0tT2vV4xX6zZ8cC0fF2hH4kK6mM8nN"
-    def __init__(self, config: Dict[str, str] = None):
+    def __init__(
+        self,
+        config: Dict[str, str] = None,
+        providers: Dict[str, LLMProvider] = None,
+        rate_limiter: ProviderRateLimiter = None
+    ):
         config = config or {}
         
         self.anthropic_key = config.get(
@@ -21,15 +82,160 @@ class AgentOrchestrator:
             'sk-proj-7fA9cB2XqL8MZ0dRkEwH3VnYpT6S5JmU4C1ad39dj8w30dn383n3kd8302md28dujd73293nud3sk33dg5gw2r4f4fdsr4f5hed5hf79032g'
         ) #16th commit
         
-        self.anthropic_client = anthropic.Anthropic(api_key=self.anthropic_key)
-        openai.api_key = self.openai_key
+        self.base_urls = {
+            'anthropic': config.get('anthropic_base_url'),
+            'openai': config.get('openai_base_url'),
+        }
+        
+        # Explicit providers (fakes, local stand-ins) take precedence over the
+        # process-wide shared ones
+        self.providers: Dict[str, LLMProvider] = dict(providers or {})
         
-        self.conversation_history: List[Dict] = []
+        # Pass the same rate_limiter to orchestrators sharing an API key so
+        # they draw on one budget
+        self.rate_limiter = rate_limiter or ProviderRateLimiter(
+            limits=config.get('rate_limits'),
+            retry=RetryPolicy(max_attempts=int(config.get('max_attempts', 5)))
+        )
+        
+        # Identical prompts are answered from the cache; set 'use_cache': False
+        # on a context or step to force a fresh call
+        self.cache: Optional[ResponseCache] = None
+        if config.get('cache', True):
+            self.cache = ResponseCache(
+                path=config.get('cache_path'),
+                ttl=float(config.get('cache_ttl', 24 * 60 * 60))
+            )
+        
+        # With a checkpoint_path every run's plan and step results are saved
+        # so that resume(run_id) only redoes unfinished steps
+        self.checkpoints: Optional[CheckpointStore] = None
+        if config.get('checkpoint_path'):
+            self.checkpoints = CheckpointStore(config['checkpoint_path'])
+        
+        # Previous results are rendered into prompts within this token budget
+        self.context_window = ContextWindowManager(
+            summarize=self._summarize_result,
+            budget=int(config.get('context_token_budget', DEFAULT_CONTEXT_BUDGET))
+        )
+        
+        # Step outputs beyond this many tokens are synthesized map-reduce style
+        self.synthesis_chunk_tokens = int(
+            config.get('synthesis_chunk_tokens', DEFAULT_SYNTHESIS_CHUNK_TOKENS)
+        )
+        
+        # Every run is traced (spans, tokens, cost, critical path) and the
+        # report attached as result['trace']; trace_path also exports JSONL
+        self.tracer = Tracer(
+            path=config.get('trace_path'),
+            enabled=bool(config.get('tracing', True))
+        )
+        
+        # Only the newest history_max_entries stay in memory; with a
+        # history_path all of it is kept in an append-only log
+        self.history = HistoryStore(
+            path=config.get('history_path'),
+            max_entries=int(config.get('history_max_entries', DEFAULT_HISTORY_ENTRIES))
+        )
         self.max_iterations = 10
+        self.max_concurrency = int(config.get('max_concurrency', DEFAULT_MAX_CONCURRENCY))
+        self.agent_timeout: Optional[float] = config.get('agent_timeout')
+        self.provider_concurrency: Dict[str, int] = dict(config.get('provider_concurrency') or {})
+        
+    async def execute_task(
+        self,
+        task: str,
+        context: Dict = None,
+        run_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        return await self._execute(task, context or {}, run_id=run_id)
+    
+    async def resume(self, run_id: str) -> Dict[str, Any]:
+        """
+        Finish a checkpointed run, re-executing only steps that did not complete.
+        
+        The saved plan is reused (a new one is made if planning never
+        finished) and results of completed steps are fed back in as-is.
+        A run that already completed returns its saved result.
+        """
+        if self.checkpoints is None:
+            raise RuntimeError("resume() needs a checkpoint_path in the orchestrator config")
         
-    async def execute_task(self, task: str, context: Dict = None) -> Dict[str, Any]:
-        context = context or {}
+        run = await self.checkpoints.load_run(run_id)
+        if run['status'] == 'completed':
+            return run['result']
         
+        completed = {
+            step_id: step for step_id, step in run['steps'].items()
+            if step['status'] == 'completed'
+        }
+        return await self._execute(
+            run['task'], run['context'], run_id=run_id, plan=run['plan'], completed=completed
+        )
+    
+    async def execute_task_stream(
+        self,
+        task: str,
+        context: Dict = None,
+        run_id: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Run a task like execute_task, yielding progress events as they happen.
+        
+        Event types, each a dict with a 'type' key:
+            plan_ready       {'plan'}
+            step_started     {'step_id', 'step'}
+            token_delta      {'step_id', 'text'}   text of a step as it streams
+            stream_reset     {'step_id'}           a call failed mid-stream and is retried:
+                                                   drop the deltas its failed attempt sent;
+                                                   no step_id means the synthesis
+            step_completed   {'step_id', 'result'} also sent for failed steps
+            synthesis_delta  {'text'}
+            synthesis        {'output'}
+            result           {'result'}            always last; same dict execute_task returns
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        runner = asyncio.create_task(self._execute(task, context or {}, queue.put_nowait, run_id))
+        runner.add_done_callback(lambda _: queue.put_nowait(None))
+        
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield event
+            
+            yield {'type': 'result', 'result': await runner}
+        finally:
+            if not runner.done():
+                runner.cancel()
+                await asyncio.gather(runner, return_exceptions=True)
+    
+    async def _execute(
+        self,
+        task: str,
+        context: Dict,
+        emit: Optional[Emit] = None,
+        run_id: Optional[str] = None,
+        plan: Optional[Dict] = None,
+        completed: Optional[Dict[str, Dict]] = None
+    ) -> Dict[str, Any]:
+        with self.tracer.span('execute_task', 'task', task=task[:200]) as root:
+            result = await self._execute_traced(task, context, emit, run_id, plan, completed)
+        
+        if root.report is not None:
+            result['trace'] = root.report
+        return result
+    
+    async def _execute_traced(
+        self,
+        task: str,
+        context: Dict,
+        emit: Optional[Emit],
+        run_id: Optional[str],
+        plan: Optional[Dict],
+        completed: Optional[Dict[str, Dict]]
+    ) -> Dict[str, Any]:
         result = {
             'task': task,
             'started_at': datetime.utcnow().isoformat(),
@@ -38,23 +244,334 @@ class AgentOrchestrator:
             'status': 'in_progress'
         }
         
-        plan = await self._create_plan(task, context)
+        if self.checkpoints is not None:
+            run_id = run_id or uuid.uuid4().hex
+            result['run_id'] = run_id
+            await self.checkpoints.start_run(run_id, task, context)
+        
+        if plan is None:
+            with self.tracer.span('plan', 'plan'):
+                plan = await self._create_plan(task, context)
+            if self.checkpoints is not None:
+                await self.checkpoints.save_plan(run_id, plan)
         result['plan'] = plan
         
-        for step in plan['steps']:
-            step_result = await self._execute_step(step, context)
-            result['steps'].append(step_result)
-            
-            if step_result['status'] == 'failed':
-                result['status'] = 'failed'
-                return result
+        try:
+            result['steps'] = await self._run_plan(
+                plan['steps'], context, completed=completed, emit=emit,
+                run_id=result.get('run_id')
+            )
+        except PlanError as e:
+            result['status'] = 'failed'
+            result['error'] = str(e)
+            return await self._finish_run(result)
+        
+        if any(step['status'] != 'completed' for step in result['steps']):
+            result['status'] = 'failed'
+            return await self._finish_run(result)
                 
-        result['final_output'] = await self._synthesize_results(result['steps'])
+        if emit:
+            token = _token_sink.set((
+                lambda text: emit({'type': 'synthesis_delta', 'text': text}),
+                lambda: emit({'type': 'stream_reset'})
+            ))
+            try:
+                result['final_output'] = await self._synthesize_results(
+                    result['steps'], use_cache=context.get('use_cache', True)
+                )
+            finally:
+                _token_sink.reset(token)
+            emit({'type': 'synthesis', 'output': result['final_output']})
+        else:
+            result['final_output'] = await self._synthesize_results(
+                result['steps'], use_cache=context.get('use_cache', True)
+            )
+        
         result['status'] = 'completed'
         result['completed_at'] = datetime.utcnow().isoformat()
         
+        return await self._finish_run(result)
+    
+    async def _finish_run(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        if 'run_id' in result:
+            await self.checkpoints.finish_run(result['run_id'], result)
         return result
     
+    def _normalize_steps(self, steps: List[Any]) -> List[Dict]:
+        """
+        Give every step an 'id' and a 'depends_on' list of step ids.
+        
+        Steps without an id are numbered by position ('1', '2', ...) so that
+        plans which refer to earlier steps by number still resolve.
+        """
+        normalized = []
+        for i, step in enumerate(steps):
+            if not isinstance(step, dict):
+                step = {'description': str(step)}
+            step['id'] = str(step.get('id', i + 1))
+            depends_on = step.get('depends_on') or []
+            if not isinstance(depends_on, list):
+                depends_on = [depends_on]
+            step['depends_on'] = [str(dep) for dep in depends_on]
+            needs = step.get('needs')
+            if needs is not None:
+                if not isinstance(needs, list):
+                    needs = [needs]
+                step['needs'] = [str(dep) for dep in needs]
+            normalized.append(step)
+        
+        ids = [step['id'] for step in normalized]
+        if len(set(ids)) != len(ids):
+            raise PlanError(f"Duplicate step ids in plan: {ids}")
+        
+        for step in normalized:
+            unknown = [dep for dep in step['depends_on'] if dep not in ids]
+            if unknown:
+                raise PlanError(f"Step {step['id']} depends on unknown steps: {unknown}")
+        
+        # Kahn's algorithm, only to reject cycles before anything runs
+        remaining = {step['id']: set(step['depends_on']) for step in normalized}
+        while remaining:
+            ready = [step_id for step_id, deps in remaining.items() if not deps]
+            if not ready:
+                raise PlanError(f"Dependency cycle between steps: {sorted(remaining)}")
+            for step_id in ready:
+                del remaining[step_id]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+        
+        return normalized
+    
+    def _step_context(self, step: Dict, context: Dict, results: Dict[str, Dict]) -> Dict:
+        # A step may narrow the dependency outputs it sees with 'needs'
+        needs = step.get('needs')
+        inputs = [dep for dep in step['depends_on'] if needs is None or dep in needs]
+        if not inputs:
+            return context
+        
+        return {
+            **context,
+            'previous_results': [results[dep]['output'] for dep in inputs]
+        }
+    
+    async def _previous_results(self, context: Dict, model: str, use_cache: bool = True) -> Tuple[str, int]:
+        """Render context['previous_results'] within the token budget."""
+        previous = context.get('previous_results')
+        if not previous:
+            return '', 0
+        if not isinstance(previous, list):
+            previous = [previous]
+        
+        return await self.context_window.render(previous, model, use_cache=use_cache)
+    
+    async def _summarize_result(self, text: str, use_cache: bool = True) -> str:
+        messages = [
+            {
+                'role': 'user',
+                'content': f"Summarize the key facts and conclusions of this result in a few sentences:\n\n{text}"
+            }
+        ]
+        
+        response = await self._without_streaming(self._complete(
+            'anthropic', SUMMARY_MODEL, messages, self.context_window.summary_tokens,
+            use_cache=use_cache
+        ))
+        return response.text
+    
+    @staticmethod
+    async def _without_streaming(awaitable):
+        """Await internal calls (summaries) without streaming their text."""
+        token = _token_sink.set(None)
+        try:
+            return await awaitable
+        finally:
+            _token_sink.reset(token)
+    
+    async def _run_plan(
+        self,
+        steps: List[Any],
+        context: Dict,
+        completed: Optional[Dict[str, Dict]] = None,
+        emit: Optional[Emit] = None,
+        run_id: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Execute plan steps as soon as their dependencies have completed.
+        
+        At most max_concurrency steps run at once. The first failed step
+        cancels every sibling still in flight and nothing new is started.
+        Results from `completed` (step id -> step result) are reused instead
+        of being executed again.
+        
+        Returns step results in plan order; steps that never started are
+        left out, cancelled ones are reported with status 'cancelled'.
+        With `emit`, progress events are sent as described in
+        execute_task_stream; with `run_id`, each finished step is
+        checkpointed before the next scheduling round.
+        """
+        steps = self._normalize_steps(steps)
+        if emit:
+            emit({'type': 'plan_ready', 'plan': {'steps': steps}})
+        
+        results: Dict[str, Dict] = dict(completed or {})
+        pending = {step['id']: step for step in steps if step['id'] not in results}
+        running: Dict[asyncio.Task, Dict] = {}
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        failed = False
+        
+        async def run(step: Dict) -> Dict:
+            scheduled = time.monotonic()
+            async with semaphore:
+                if emit:
+                    emit({'type': 'step_started', 'step_id': step['id'], 'step': step})
+                    _token_sink.set((
+                        lambda text: emit({'type': 'token_delta', 'step_id': step['id'], 'text': text}),
+                        lambda: emit({'type': 'stream_reset', 'step_id': step['id']})
+                    ))
+                with self.tracer.span(
+                    f"step {step['id']}", 'step',
+                    step_id=step['id'],
+                    action=step.get('action', 'analyze'),
+                    depends_on=step['depends_on'],
+                    queue_wait_ms=round((time.monotonic() - scheduled) * 1000, 3)
+                ) as span:
+                    step_result = await self._execute_step(step, self._step_context(step, context, results))
+                    span.set(status=step_result['status'])
+                    return step_result
+        
+        def finish(step: Dict, step_result: Dict):
+            results[step['id']] = step_result
+            if emit:
+                emit({'type': 'step_completed', 'step_id': step['id'], 'result': step_result})
+        
+        try:
+            while pending or running:
+                for step_id, step in list(pending.items()):
+                    if all(dep in results for dep in step['depends_on']):
+                        del pending[step_id]
+                        running[asyncio.create_task(run(step))] = step
+                
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                finished_ids = []
+                
+                for finished in done:
+                    step = running.pop(finished)
+                    finished_ids.append(step['id'])
+                    if finished.exception() is not None:
+                        finish(step, {
+                            'step': step,
+                            'status': 'failed',
+                            'error': str(finished.exception()),
+                            'timestamp': datetime.utcnow().isoformat()
+                        })
+                    else:
+                        finish(step, finished.result())
+                    
+                    if results[step['id']]['status'] == 'failed':
+                        failed = True
+                
+                if run_id is not None:
+                    for step_id in finished_ids:
+                        await self.checkpoints.save_step(run_id, step_id, results[step_id])
+                
+                if failed:
+                    break
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+        
+        for step in running.values():
+            finish(step, {
+                'step': step,
+                'status': 'cancelled',
+                'timestamp': datetime.utcnow().isoformat()
+            })
+        
+        return [results[step['id']] for step in steps if step['id'] in results]
+    
+    async def _provider(self, name: str) -> LLMProvider:
+        if name in self.providers:
+            return self.providers[name]
+        
+        api_key = self.anthropic_key if name == 'anthropic' else self.openai_key
+        return await aget_provider(name, api_key, self.base_urls.get(name))
+    
+    async def _complete(
+        self,
+        provider: str,
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        use_cache: bool = True
+    ) -> Completion:
+        with self.tracer.span(f'{provider} {model}', 'llm', provider=provider, model=model) as span:
+            return await self._complete_traced(span, provider, model, messages, max_tokens, use_cache)
+    
+    async def _complete_traced(
+        self,
+        span,
+        provider: str,
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        use_cache: bool
+    ) -> Completion:
+        sink = _token_sink.get()
+        
+        if self.cache is not None and use_cache:
+            key = cache_key(provider, model, messages, max_tokens)
+            cached = await self.cache.get(key)
+            if cached is not None:
+                span.set(cache_hit=True)
+                if sink:
+                    sink[0](cached.text)
+                return cached
+        
+        client = await self._provider(provider)
+        requested = time.monotonic()
+        attempts = 0
+        streamed = False
+        
+        def on_text(text: str):
+            nonlocal streamed
+            streamed = True
+            sink[0](text)
+        
+        def request():
+            # Time until the first attempt is spent queued in the rate limiter
+            nonlocal attempts, streamed
+            attempts += 1
+            if attempts == 1:
+                span.set(queue_wait_ms=round((time.monotonic() - requested) * 1000, 3))
+            if sink:
+                if streamed:
+                    sink[1]()
+                    streamed = False
+                return client.stream(model, messages, max_tokens, on_text)
+            return client.complete(model, messages, max_tokens)
+        
+        estimated_tokens = sum(count_tokens(m['content'], model) for m in messages) + max_tokens
+        try:
+            response = await self.rate_limiter.call(provider, model, estimated_tokens, request)
+        finally:
+            span.set(attempts=attempts)
+        
+        span.set(
+            input_tokens=response.input_tokens,
+            output_tokens=response.output_tokens,
+            cost_usd=estimate_cost(response.model or model, response.input_tokens, response.output_tokens)
+        )
+        
+        if self.cache is not None and use_cache:
+            await self.cache.set(key, response)
+        return response
+    
+    @staticmethod
+    def _use_cache(step: Dict, context: Dict) -> bool:
+        return bool(step.get('use_cache', context.get('use_cache', True)))
+    
     async def _create_plan(self, task: str, context: Dict) -> Dict:
         messages = [
             {
@@ -63,17 +580,20 @@ class AgentOrchestrator:
             },
             {
                 'role': 'user',
-                'content': f"Create a step-by-step plan to accomplish this task: {task}\n\nContext: {json.dumps(context)}\n\nRespond with a JSON array of steps."
+                'content': f"Create a step-by-step plan to accomplish this task: {task}\n\nContext: {json.dumps(context)}\n\n"
+                    "Respond with a JSON array of steps. Each step is an object with "
+                    "'id', 'action' (analyze, generate or research), 'description' and "
+                    "'depends_on' (ids of the steps whose output it needs; empty when "
+                    "the step can start right away)."
             }
         ]
         
-        response = self.anthropic_client.messages.create(
-            model='claude-sonnet-4-20250514',
-            max_tokens=2000,
-            messages=messages
+        response = await self._complete(
+            'anthropic', CLAUDE_MODEL, messages, 2000,
+            use_cache=context.get('use_cache', True)
         )
         
-        plan_text = response.content[0].text
+        plan_text = response.text
         
         try:
             plan_data = json.loads(plan_text)
@@ -100,44 +620,53 @@ class AgentOrchestrator:
             {'role': 'user', 'content': prompt}
         ]
         
-        if context.get('previous_results'):
-            messages[0]['content'] += f"\n\nPrevious results: {json.dumps(context['previous_results'])}"
+        previous, context_tokens = await self._previous_results(
+            context, CLAUDE_MODEL, self._use_cache(step, context)
+        )
+        if previous:
+            messages[0]['content'] += f"\n\nPrevious results:\n{previous}"
         
-        response = self.anthropic_client.messages.create(
-            model='claude-sonnet-4-20250514',
-            max_tokens=4000,
-            messages=messages
+        response = await self._complete(
+            'anthropic', CLAUDE_MODEL, messages, 4000,
+            use_cache=self._use_cache(step, context)
         )
         
         return {
             'step': step,
             'status': 'completed',
-            'output': response.content[0].text,
+            'output': response.text,
             'model': 'claude-sonnet-4',
+            'input_tokens': response.input_tokens or count_tokens(messages[0]['content'], CLAUDE_MODEL),
+            'context_tokens': context_tokens,
             'timestamp': datetime.utcnow().isoformat()
         }
     
     async def _generate_with_gpt(self, step: Dict, context: Dict) -> Dict:
         prompt = step.get('description', step.get('prompt', ''))
         
-        if context.get('previous_results'):
-            prompt += f"\n\nPrevious results: {json.dumps(context['previous_results'])}"
-        
-        response = await asyncio.to_thread(
-            openai.ChatCompletion.create,
-            model='gpt-4-turbo',
-            messages=[
-                {'role': 'system', 'content': 'You are a helpful AI assistant.'},
-                {'role': 'user', 'content': prompt}
-            ],
-            max_tokens=3000
+        previous, context_tokens = await self._previous_results(
+            context, GPT_MODEL, self._use_cache(step, context)
+        )
+        if previous:
+            prompt += f"\n\nPrevious results:\n{previous}"
+        
+        messages = [
+            {'role': 'system', 'content': 'You are a helpful AI assistant.'},
+            {'role': 'user', 'content': prompt}
+        ]
+        
+        response = await self._complete(
+            'openai', GPT_MODEL, messages, 3000,
+            use_cache=self._use_cache(step, context)
         )
         
         return {
             'step': step,
             'status': 'completed',
-            'output': response.choices[0].message.content,
+            'output': response.text,
             'model': 'gpt-4-turbo',
+            'input_tokens': response.input_tokens or count_tokens(prompt, GPT_MODEL),
+            'context_tokens': context_tokens,
             'timestamp': datetime.utcnow().isoformat()
         }
     
@@ -151,28 +680,55 @@ class AgentOrchestrator:
             }
         ]
         
-        response = self.anthropic_client.messages.create(
-            model='claude-sonnet-4-20250514',
-            max_tokens=8000,
-            messages=messages
+        response = await self._complete(
+            'anthropic', CLAUDE_MODEL, messages, 8000,
+            use_cache=self._use_cache(step, context)
         )
         
         return {
             'step': step,
             'status': 'completed',
-            'output': response.content[0].text,
+            'output': response.text,
             'model': 'claude-sonnet-4',
+            'input_tokens': response.input_tokens or count_tokens(messages[0]['content'], CLAUDE_MODEL),
             'timestamp': datetime.utcnow().isoformat()
         }
     
     async def _execute_generic(self, step: Dict, context: Dict) -> Dict:
         return await self._analyze_with_claude(step, context)
     
-    async def _synthesize_results(self, steps: List[Dict]) -> str:
-        results_summary = "\n\n".join([
-            f"Step {i+1}: {step['output'][:200]}..."
-            for i, step in enumerate(steps)
-        ])
+    async def _synthesize_results(self, steps: List[Dict], use_cache: bool = True) -> str:
+        """
+        Combine step outputs into the final answer.
+        
+        Outputs that fit synthesis_chunk_tokens go into a single call in
+        full. Larger sets are packed into chunks of that size (an output
+        larger than a chunk is split across several, not cut short), the chunks
+        are summarized in parallel and the summaries are reduced the same
+        way until they fit. Partial summaries go through the response
+        cache, so a re-run with the same outputs reuses them, unless
+        use_cache is False.
+        """
+        with self.tracer.span('synthesis', 'synthesis', steps=len(steps)):
+            return await self._synthesize_traced(steps, use_cache)
+    
+    async def _synthesize_traced(self, steps: List[Dict], use_cache: bool) -> str:
+        parts = [f"Step {i+1}: {step['output']}" for i, step in enumerate(steps)]
+        
+        total = sum(count_tokens(part, CLAUDE_MODEL) for part in parts)
+        while total > self.synthesis_chunk_tokens:
+            chunks = self._chunk_by_tokens(parts, self.synthesis_chunk_tokens)
+            parts = list(await self._without_streaming(asyncio.gather(
+                *(self._summarize_chunk(chunk, use_cache) for chunk in chunks)
+            )))
+            
+            reduced = sum(count_tokens(part, CLAUDE_MODEL) for part in parts)
+            if reduced >= total:
+                # Summaries stopped shrinking (budget below summary size)
+                break
+            total = reduced
+        
+        results_summary = truncate_to_tokens("\n\n".join(parts), CLAUDE_MODEL, self.synthesis_chunk_tokens)
         
         messages = [
             {
@@ -181,60 +737,263 @@ class AgentOrchestrator:
             }
         ]
         
-        response = self.anthropic_client.messages.create(
-            model='claude-sonnet-4-20250514',
-            max_tokens=4000,
-            messages=messages
-        )
+        response = await self._complete('anthropic', CLAUDE_MODEL, messages, 4000, use_cache=use_cache)
         
-        return response.content[0].text
+        return response.text
+    
+    @staticmethod
+    def _chunk_by_tokens(parts: List[str], budget: int) -> List[List[str]]:
+        """Pack parts into chunks of at most `budget` tokens; larger parts span several chunks."""
+        chunks: List[List[str]] = [[]]
+        used = 0
+        for part in parts:
+            for piece in split_to_tokens(part, CLAUDE_MODEL, budget):
+                tokens = count_tokens(piece, CLAUDE_MODEL)
+                if chunks[-1] and used + tokens > budget:
+                    chunks.append([])
+                    used = 0
+                chunks[-1].append(piece)
+                used += tokens
+        return chunks
+    
+    async def _summarize_chunk(self, chunk: List[str], use_cache: bool = True) -> str:
+        messages = [
+            {
+                'role': 'user',
+                'content': (
+                    "Condense these intermediate results into one summary. Keep every fact, "
+                    "figure and conclusion a final synthesis would need:\n\n" + "\n\n".join(chunk)
+                )
+            }
+        ]
+        
+        response = await self._complete(
+            'anthropic', CLAUDE_MODEL, messages, PARTIAL_SUMMARY_TOKENS, use_cache=use_cache
+        )
+        return response.text
     
     async def multi_agent_collaboration(
         self, 
         task: str, 
-        agents: List[str] = None
+        agents: List[str] = None,
+        replicas: Dict[str, Any] = None,
+        agent_timeout: Optional[float] = None,
+        provider_concurrency: Dict[str, int] = None
     ) -> Dict[str, Any]:
-        agents = agents or ['analyzer', 'generator', 'validator']
+        """
+        Run every agent role concurrently and synthesize whatever finished.
         
-        results = {}
+        Args:
+            task: Task every agent works on
+            agents: Agent roles (default: analyzer, generator, validator)
+            replicas: Per-role replica settings, either a replica count or
+                {'n': count, 'mode': 'first_k' | 'quorum', 'k': needed,
+                'agree': key}. first_k keeps the first k successful
+                replicas; quorum waits for k replicas to agree (default k is
+                a majority). Outputs agree when `key` maps them to the same
+                value; the default, answer_key, compares JSON answers by
+                value and other text ignoring case and spacing. Without a
+                quorum the most agreed-on output is used and the role is
+                reported as 'no_quorum'. Remaining replicas are cancelled
+                either way.
+            agent_timeout: Seconds each agent (or replica) may take,
+                including time spent waiting for a provider slot
+            provider_concurrency: Max in-flight calls per provider name
         
-        for agent_role in agents:
-            step = {
-                'action': 'analyze' if agent_role == 'analyzer' else 'generate',
-                'description': f"As {agent_role}, work on: {task}"
-            }
+        Roles that fail or time out are reported in agent_results but left
+        out of the synthesis; status is 'partial' when that happens, or
+        when a role reached no quorum.
+        """
+        agents = agents or ['analyzer', 'generator', 'validator']
+        replicas = replicas or {}
+        agent_timeout = agent_timeout if agent_timeout is not None else self.agent_timeout
+        limits = {**self.provider_concurrency, **(provider_concurrency or {})}
+        semaphores = {name: asyncio.Semaphore(limit) for name, limit in limits.items()}
+        
+        with self.tracer.span('multi_agent_collaboration', 'task', task=task[:200]) as root:
+            role_results = await asyncio.gather(*(
+                self._run_agent_role(task, role, replicas.get(role, 1), agent_timeout, semaphores)
+                for role in agents
+            ))
+            results = dict(zip(agents, role_results))
             
-            result = await self._execute_step(step, {'role': agent_role})
-            results[agent_role] = result
+            usable = [result for result in results.values() if result['status'] in ('completed', 'no_quorum')]
+            final = await self._synthesize_results(usable) if usable else None
         
-        final = await self._synthesize_results(list(results.values()))
+        completed = [result for result in usable if result['status'] == 'completed']
+        if len(completed) == len(results):
+            status = 'completed'
+        else:
+            status = 'partial' if usable else 'failed'
         
-        return {
+        collaboration = {
             'task': task,
             'agent_results': results,
             'synthesis': final,
+            'status': status,
             'timestamp': datetime.utcnow().isoformat()
         }
+        if root.report is not None:
+            collaboration['trace'] = root.report
+        return collaboration
     
-    def add_to_history(self, role: str, content: str):
-        self.conversation_history.append({
-            'role': role,
-            'content': content,
+    async def _run_agent(
+        self,
+        step: Dict,
+        context: Dict,
+        timeout: Optional[float],
+        semaphores: Dict[str, asyncio.Semaphore]
+    ) -> Dict:
+        semaphore = semaphores.get(ACTION_PROVIDERS.get(step['action'], 'anthropic'))
+        
+        async def run() -> Dict:
+            with self.tracer.span(f"agent {context.get('role')}", 'step', role=context.get('role')):
+                if semaphore is None:
+                    return await self._execute_step(step, context)
+                async with semaphore:
+                    return await self._execute_step(step, context)
+        
+        try:
+            return await asyncio.wait_for(run(), timeout)
+        except asyncio.TimeoutError:
+            return {
+                'step': step,
+                'status': 'timeout',
+                'timestamp': datetime.utcnow().isoformat()
+            }
+        except Exception as e:
+            return {
+                'step': step,
+                'status': 'failed',
+                'error': str(e),
+                'timestamp': datetime.utcnow().isoformat()
+            }
+    
+    async def _run_agent_role(
+        self,
+        task: str,
+        role: str,
+        spec: Any,
+        timeout: Optional[float],
+        semaphores: Dict[str, asyncio.Semaphore]
+    ) -> Dict:
+        if not isinstance(spec, dict):
+            spec = {'n': spec}
+        n = int(spec.get('n', 1))
+        mode = spec.get('mode', 'first_k')
+        k = int(spec.get('k', n // 2 + 1 if mode == 'quorum' else 1))
+        agree = spec.get('agree', answer_key)
+        
+        step = {
+            'action': 'analyze' if role == 'analyzer' else 'generate',
+            'description': f"As {role}, work on: {task}"
+        }
+        
+        if n <= 1:
+            return await self._run_agent(step, {'role': role}, timeout, semaphores)
+        
+        # Replicas send identical prompts, so the cache would collapse them
+        step['use_cache'] = False
+        pending = {
+            asyncio.create_task(self._run_agent(step, {'role': role}, timeout, semaphores))
+            for _ in range(n)
+        }
+        finished: List[Dict] = []
+        votes: Dict[Any, List[Dict]] = {}
+        winners: List[Dict] = []
+        
+        try:
+            while pending and len(winners) < k:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task_done in done:
+                    replica = task_done.result()
+                    finished.append(replica)
+                    if replica['status'] != 'completed':
+                        continue
+                    
+                    if mode == 'quorum':
+                        ballot = votes.setdefault(agree(replica['output']), [])
+                        ballot.append(replica)
+                        if len(ballot) >= k:
+                            winners = ballot
+                    elif len(winners) < k:
+                        winners.append(replica)
+        finally:
+            for replica_task in pending:
+                replica_task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        
+        result = {
+            'step': step,
+            'replicas': n,
+            'mode': mode,
+            'k': k,
+            'replica_results': finished,
             'timestamp': datetime.utcnow().isoformat()
-        })
+        }
+        
+        if len(winners) >= k:
+            result['status'] = 'completed'
+            if mode == 'quorum':
+                result['output'] = winners[0]['output']
+            else:
+                result['output'] = '\n\n---\n\n'.join(winner['output'] for winner in winners)
+        elif mode == 'quorum' and votes:
+            result['status'] = 'no_quorum'
+            result['output'] = max(votes.values(), key=len)[0]['output']
+        else:
+            result['status'] = 'failed'
+        
+        return result
+    
+    @property
+    def conversation_history(self) -> List[Dict]:
+        return self.get_history()
     
-    def get_history(self) -> List[Dict]:
-        return self.conversation_history
+    @conversation_history.setter
+    def conversation_history(self, entries: List[Dict]):
+        """Replace the history with `entries`, e.g. [] to start over."""
+        self.history.clear()
+        for entry in entries:
+            self.history.append(entry['role'], entry['content'], entry.get('timestamp'))
+    
+    def add_to_history(self, role: str, content: str):
+        self.history.append(role, content)
+    
+    def get_history(
+        self,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        since: Optional[Timestamp] = None,
+        until: Optional[Timestamp] = None,
+        all_entries: bool = False
+    ) -> List[Dict]:
+        """
+        Return history entries as {'role', 'content', 'timestamp'} dicts.
+        
+        Without limit, since, until or all_entries only the entries still
+        in memory (the newest history_max_entries) are returned, so callers
+        never pull a long on-disk log back into memory by accident. Page
+        with offset/limit and narrow by time with since/until (epoch
+        seconds or UTC datetimes) to read older entries from the log;
+        all_entries=True returns everything retained.
+        """
+        if limit is None and since is None and until is None and not all_entries:
+            offset = max(offset, self.history.memory_position)
+        return [record.to_dict() for record in self.history.get(offset, limit, since, until)]
     
     def clear_history(self):
-        self.conversation_history = []
+        self.history.clear()
 
 
 async def main():
     orchestrator = AgentOrchestrator()
     
     task = "Analyze the benefits and drawbacks of remote work"
-    result = await orchestrator.execute_task(task)
+    try:
+        result = await orchestrator.execute_task(task)
+    finally:
+        await close_providers()
     
     print(f"Task: {result['task']}")
     print(f"Status: {result['status']}")
@@ -0,0 +1,370 @@
+"""
+Async LLM provider layer for the agent orchestrator.
+
+Every provider wraps the vendor's async SDK client, which keeps a pool of
+keep-alive HTTP connections. Providers are shared process-wide through
+get_provider(), so any number of AgentOrchestrator instances reuse the
+same connections instead of opening their own.
+
+The vendor SDKs are imported the first time a provider that needs them is
+constructed, so importing this module (and agent_planner) stays cheap and
+a process that only talks to one vendor never loads the other SDK. Async
+code should use aget_provider(), which runs that import in a worker thread
+instead of stalling the event loop for it.
+"""
+
+import asyncio
+import functools
+import importlib
+import random
+import sys
+import time
+import weakref
+from collections import deque
+from dataclasses import dataclass
+from types import ModuleType
+from typing import Callable, List, Dict, Optional, Tuple
+
+
+@dataclass
+class Completion:
+    """Text and token usage returned by a single provider call."""
+    text: str
+    model: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+
+class ProviderError(Exception):
+    """A provider call failed in a way that is worth retrying."""
+
+
+class RateLimitError(ProviderError):
+    """The provider answered 429; retry_after is its hint in seconds, if any."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _retry_after(response) -> Optional[float]:
+    try:
+        return float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _load_sdk(name: str) -> ModuleType:
+    """Import a vendor SDK on first use."""
+    try:
+        return importlib.import_module(name)
+    except ImportError as e:
+        raise ImportError(f"The '{name}' provider needs the {name} package: pip install {name}") from e
+
+
+def _translate_errors(sdk_name: str):
+    """Map an SDK's retryable exceptions onto ProviderError types."""
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await method(*args, **kwargs)
+            except Exception as e:
+                # The provider's constructor has imported the SDK by now
+                sdk = sys.modules[sdk_name]
+                if isinstance(e, sdk.RateLimitError):
+                    raise RateLimitError(str(e), _retry_after(e.response)) from e
+                if isinstance(e, sdk.APIStatusError) and e.status_code >= 500:
+                    raise ProviderError(str(e)) from e
+                if isinstance(e, (sdk.APIConnectionError, sdk.APITimeoutError)):
+                    raise ProviderError(str(e)) from e
+                raise
+        return wrapper
+    return decorator
+
+
+class LLMProvider:
+    """
+    Base class for chat-completion providers.
+
+    Messages use the OpenAI-style list of {'role', 'content'} dicts; each
+    provider translates them to whatever its API expects.
+    """
+
+    name = 'base'
+    # Vendor SDK module the constructor imports, if any
+    sdk: Optional[str] = None
+
+    async def complete(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int
+    ) -> Completion:
+        raise NotImplementedError
+
+    async def stream(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        on_text: Callable[[str], None]
+    ) -> Completion:
+        """
+        Like complete(), but hand text to on_text as it arrives.
+
+        Providers without a streaming API deliver the whole text at once.
+        """
+        completion = await self.complete(model, messages, max_tokens)
+        on_text(completion.text)
+        return completion
+
+    async def aclose(self):
+        pass
+
+
+class AnthropicProvider(LLMProvider):
+    name = 'anthropic'
+    sdk = 'anthropic'
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None):
+        # Retries are left to the orchestrator's rate limiter
+        self.client = _load_sdk('anthropic').AsyncAnthropic(api_key=api_key, base_url=base_url, max_retries=0)
+
+    @staticmethod
+    def _split_system(messages: List[Dict[str, str]]) -> Tuple[Optional[str], List[Dict[str, str]]]:
+        """Anthropic takes system prompts as a separate argument, not a message."""
+        system = [m['content'] for m in messages if m['role'] == 'system']
+        rest = [m for m in messages if m['role'] != 'system']
+        return ('\n\n'.join(system) if system else None), rest
+
+    @_translate_errors('anthropic')
+    async def complete(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int
+    ) -> Completion:
+        system, messages = self._split_system(messages)
+        kwargs = {'system': system} if system else {}
+
+        response = await self.client.messages.create(
+            model=model,
+            max_tokens=max_tokens,
+            messages=messages,
+            **kwargs
+        )
+
+        return Completion(
+            text=''.join(block.text for block in response.content if block.type == 'text'),
+            model=response.model,
+            input_tokens=response.usage.input_tokens,
+            output_tokens=response.usage.output_tokens
+        )
+
+    @_translate_errors('anthropic')
+    async def stream(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        on_text: Callable[[str], None]
+    ) -> Completion:
+        system, messages = self._split_system(messages)
+        kwargs = {'system': system} if system else {}
+
+        async with self.client.messages.stream(
+            model=model,
+            max_tokens=max_tokens,
+            messages=messages,
+            **kwargs
+        ) as stream:
+            async for text in stream.text_stream:
+                on_text(text)
+            response = await stream.get_final_message()
+
+        return Completion(
+            text=''.join(block.text for block in response.content if block.type == 'text'),
+            model=response.model,
+            input_tokens=response.usage.input_tokens,
+            output_tokens=response.usage.output_tokens
+        )
+
+    async def aclose(self):
+        await self.client.close()
+
+
+class OpenAIProvider(LLMProvider):
+    name = 'openai'
+    sdk = 'openai'
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None):
+        self.client = _load_sdk('openai').AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+
+    @_translate_errors('openai')
+    async def complete(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int
+    ) -> Completion:
+        response = await self.client.chat.completions.create(
+            model=model,
+            max_tokens=max_tokens,
+            messages=messages
+        )
+
+        usage = response.usage
+        return Completion(
+            text=response.choices[0].message.content or '',
+            model=response.model,
+            input_tokens=usage.prompt_tokens if usage else 0,
+            output_tokens=usage.completion_tokens if usage else 0
+        )
+
+    @_translate_errors('openai')
+    async def stream(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        on_text: Callable[[str], None]
+    ) -> Completion:
+        chunks = await self.client.chat.completions.create(
+            model=model,
+            max_tokens=max_tokens,
+            messages=messages,
+            stream=True,
+            stream_options={'include_usage': True}
+        )
+
+        parts = []
+        usage = None
+        async for chunk in chunks:
+            model = chunk.model or model
+            if chunk.usage:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                on_text(chunk.choices[0].delta.content)
+
+        return Completion(
+            text=''.join(parts),
+            model=model,
+            input_tokens=usage.prompt_tokens if usage else 0,
+            output_tokens=usage.completion_tokens if usage else 0
+        )
+
+    async def aclose(self):
+        await self.client.close()
+
+
+class FakeProvider(LLMProvider):
+    """
+    Local stand-in provider for tests and benchmarks; no network involved.
+
+    Replies echo the prompt after `latency` seconds (plus up to `jitter`).
+    With `rpm` set, calls beyond that many per rolling minute get a
+    RateLimitError with a retry-after hint, like a real 429. `error_rate`
+    adds random ProviderErrors.
+    """
+
+    name = 'fake'
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rpm: Optional[int] = None,
+        error_rate: float = 0.0,
+        reply: Optional[Callable[[List[Dict[str, str]]], str]] = None,
+        seed: Optional[int] = None
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.rpm = rpm
+        self.error_rate = error_rate
+        self.reply = reply or (lambda messages: f"Echo: {messages[-1]['content'][:200]}")
+        self.calls = 0
+        self.rate_limited = 0
+        self._random = random.Random(seed)
+        self._window = deque()
+
+    def _admit(self):
+        self.calls += 1
+        now = time.monotonic()
+        while self._window and self._window[0] <= now - 60:
+            self._window.popleft()
+
+        if self.rpm is not None and len(self._window) >= self.rpm:
+            self.rate_limited += 1
+            raise RateLimitError('429 rate limit exceeded', retry_after=self._window[0] + 60 - now)
+        self._window.append(now)
+
+        if self._random.random() < self.error_rate:
+            raise ProviderError('500 injected failure')
+
+    async def complete(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int
+    ) -> Completion:
+        self._admit()
+        await asyncio.sleep(self.latency + self._random.uniform(0, self.jitter))
+
+        text = self.reply(messages)
+        return Completion(
+            text=text,
+            model=model,
+            input_tokens=sum(len(m['content']) for m in messages) // 4,
+            output_tokens=len(text) // 4
+        )
+
+
+PROVIDERS = {
+    'anthropic': AnthropicProvider,
+    'openai': OpenAIProvider,
+}
+
+# Async HTTP connections belong to the event loop that opened them, so the
+# shared providers are kept per loop and dropped together with it.
+_shared: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[tuple, LLMProvider]]' = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_provider(name: str, api_key: str, base_url: Optional[str] = None) -> LLMProvider:
+    """
+    Return the process-wide provider for (name, api_key, base_url).
+
+    Must be called from inside a running event loop.
+    """
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown provider: {name}")
+
+    providers = _shared.setdefault(asyncio.get_running_loop(), {})
+    key = (name, api_key, base_url)
+
+    if key not in providers:
+        providers[key] = PROVIDERS[name](api_key, base_url)
+
+    return providers[key]
+
+
+async def aget_provider(name: str, api_key: str, base_url: Optional[str] = None) -> LLMProvider:
+    """
+    get_provider() for coroutines: a vendor SDK that is not loaded yet is
+    imported in a worker thread, so the event loop keeps serving other
+    calls meanwhile.
+    """
+    sdk = PROVIDERS[name].sdk if name in PROVIDERS else None
+    if sdk and sdk not in sys.modules:
+        await asyncio.to_thread(_load_sdk, sdk)
+    return get_provider(name, api_key, base_url)
+
+
+async def close_providers():
+    """Close the shared providers of the running loop and their connections."""
+    providers = _shared.pop(asyncio.get_running_loop(), {})
+    await asyncio.gather(*(provider.aclose() for provider in providers.values()))
@@ -0,0 +1,265 @@
+"""
+Provider-aware rate limiting for orchestrator LLM calls.
+
+Every (provider, model) pair gets:
+    - token buckets for its requests-per-minute and tokens-per-minute limits
+    - an AIMD concurrency limit that halves on 429s and creeps back up
+      while calls succeed, so throughput settles just under the limit
+    - retries with jittered exponential backoff that honor retry-after;
+      a retry-after longer than the policy's max_delay fails the call at
+      once, and every caller of the pair holds off until it has passed
+"""
+
+import asyncio
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from agent_providers import Completion, ProviderError, RateLimitError
+
+
+DEFAULT_ADAPTIVE_CONCURRENCY = 16
+
+
+class TokenBucket:
+    """
+    Refills `per_minute` units per minute up to `burst`.
+
+    Callers reserve capacity up front and sleep off any deficit, so waiting
+    requests are served roughly in arrival order and never starve.
+    """
+
+    def __init__(self, per_minute: float, burst: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` units and return how long to wait before using them."""
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+        return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, amount: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def pause(self, seconds: float):
+        """Hold back new reservations for `seconds`, e.g. after a retry-after."""
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class AdaptiveConcurrency:
+    """
+    Concurrency limit with additive increase and multiplicative decrease.
+
+    Each success raises the limit by 1/limit (about one per round of calls);
+    a throttle halves it, at most once per round-trip so that one burst of
+    429s counts as a single signal. The round-trip is a moving average of
+    successful call latency, `cooldown` until the first success.
+    """
+
+    def __init__(
+        self,
+        initial: int = DEFAULT_ADAPTIVE_CONCURRENCY,
+        minimum: int = 1,
+        maximum: Optional[int] = None,
+        cooldown: float = 1.0
+    ):
+        self.minimum = minimum
+        self.maximum = maximum or initial
+        self.limit = float(initial)
+        self.cooldown = cooldown
+        self.rtt: Optional[float] = None
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        self._last_decrease = 0.0
+
+    async def acquire(self):
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                else:
+                    # Already woken; hand the wakeup on to someone else
+                    self._wake()
+                raise
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def on_success(self, latency: Optional[float] = None):
+        if latency is not None:
+            self.rtt = latency if self.rtt is None else 0.8 * self.rtt + 0.2 * latency
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self._wake()
+
+    def on_throttle(self):
+        now = time.monotonic()
+        if now - self._last_decrease >= (self.rtt if self.rtt is not None else self.cooldown):
+            self.limit = max(self.minimum, self.limit / 2)
+            self._last_decrease = now
+
+    def _wake(self):
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 5
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+
+    def __post_init__(self):
+        if self.max_attempts < 1:
+            raise ValueError(f"max_attempts must be at least 1, got {self.max_attempts}")
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Full-jitter backoff, or the server's hint plus a little jitter.
+        Hints above max_delay are not retried at all (see
+        ProviderRateLimiter.call), so they are never cut short here.
+        """
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class ModelLimiter:
+    """Buckets and concurrency limit for one (provider, model) pair."""
+
+    def __init__(
+        self,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        max_concurrency: int = DEFAULT_ADAPTIVE_CONCURRENCY
+    ):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        # Monotonic time before which the server asked not to be called
+        self.not_before = 0.0
+
+    async def admit(self, estimated_tokens: int, max_wait: Optional[float] = None):
+        """
+        Wait for capacity. While a retry-after pause is in force, waits it
+        out, or raises RateLimitError if more than `max_wait` remains.
+        """
+        delay = self.not_before - time.monotonic()
+        if max_wait is not None and delay > max_wait:
+            raise RateLimitError('rate limited: waiting on an earlier retry-after', retry_after=delay)
+        delay = max(0.0, delay)
+        if self.requests:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens:
+            delay = max(delay, self.tokens.reserve(estimated_tokens))
+        if delay:
+            await asyncio.sleep(delay)
+        await self.concurrency.acquire()
+
+    def settle(self, estimated_tokens: int, used_tokens: int, latency: float):
+        """Give back the part of the token reservation that was not used."""
+        if self.tokens and used_tokens:
+            self.tokens.refund(max(0, estimated_tokens - used_tokens))
+        self.concurrency.on_success(latency)
+
+    def throttled(self, retry_after: Optional[float]):
+        """Halve concurrency and, with a hint, pause the pair for every caller."""
+        self.concurrency.on_throttle()
+        if retry_after:
+            self.not_before = max(self.not_before, time.monotonic() + retry_after)
+
+
+class ProviderRateLimiter:
+    """
+    Rate limiter shared by every call an orchestrator makes.
+
+    Args:
+        limits: Per-minute limits keyed by 'provider/model' or 'provider',
+            e.g. {'anthropic': {'rpm': 50, 'tpm': 40000}}; the more
+            specific key wins. 'max_concurrency' caps the adaptive limit.
+        retry: Backoff policy for 429s and transient provider errors
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, Dict[str, Any]]] = None,
+        retry: Optional[RetryPolicy] = None
+    ):
+        self.limits = limits or {}
+        self.retry = retry or RetryPolicy()
+        self.stats = {'calls': 0, 'retries': 0, 'rate_limited': 0, 'errors': 0}
+        self._limiters: Dict[tuple, ModelLimiter] = {}
+
+    def limiter(self, provider: str, model: str) -> ModelLimiter:
+        key = (provider, model)
+        if key not in self._limiters:
+            settings = self.limits.get(f'{provider}/{model}', self.limits.get(provider, {}))
+            self._limiters[key] = ModelLimiter(
+                rpm=settings.get('rpm'),
+                tpm=settings.get('tpm'),
+                max_concurrency=int(settings.get('max_concurrency', DEFAULT_ADAPTIVE_CONCURRENCY))
+            )
+        return self._limiters[key]
+
+    async def call(
+        self,
+        provider: str,
+        model: str,
+        estimated_tokens: int,
+        request: Callable[[], Awaitable[Completion]]
+    ) -> Completion:
+        """Run `request` under the pair's limits, retrying retryable failures."""
+        limiter = self.limiter(provider, model)
+        self.stats['calls'] += 1
+
+        for attempt in range(self.retry.max_attempts):
+            last_attempt = attempt == self.retry.max_attempts - 1
+            await limiter.admit(estimated_tokens, self.retry.max_delay)
+            started = time.monotonic()
+            try:
+                response = await request()
+            except RateLimitError as e:
+                self.stats['rate_limited'] += 1
+                limiter.throttled(e.retry_after)
+                # Retrying before the server's retry-after would only be refused again
+                if last_attempt or (e.retry_after and e.retry_after > self.retry.max_delay):
+                    raise
+                delay = self.retry.delay(attempt, e.retry_after)
+            except ProviderError:
+                self.stats['errors'] += 1
+                if last_attempt:
+                    raise
+                delay = self.retry.delay(attempt)
+            else:
+                limiter.settle(
+                    estimated_tokens,
+                    response.input_tokens + response.output_tokens,
+                    time.monotonic() - started
+                )
+                return response
+            finally:
+                limiter.concurrency.release()
+
+            self.stats['retries'] += 1
+            await asyncio.sleep(delay)
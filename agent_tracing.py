@@ -0,0 +1,239 @@
+"""
+Span tracing for orchestrator runs.
+
+Each run is a tree of spans (task -> plan / steps / synthesis -> LLM
+calls) with wall-clock start and end times, queue wait, token usage and
+estimated cost. When a root span ends its trace is summarized into a
+report with a critical path, and optionally exported as JSON lines by a
+background writer thread, so tracing costs a few microseconds per span
+on the event loop.
+"""
+
+import atexit
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+
+# USD per million (input, output) tokens, matched by model name prefix
+PRICES_PER_MTOK = {
+    'claude-sonnet-4': (3.0, 15.0),
+    'claude-opus-4': (15.0, 75.0),
+    'claude-3-5-haiku': (0.8, 4.0),
+    'gpt-4-turbo': (10.0, 30.0),
+    'gpt-4o-mini': (0.15, 0.6),
+    'gpt-4o': (2.5, 10.0),
+}
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    # Longest prefix first so 'gpt-4o-mini' is not priced as 'gpt-4o'
+    for prefix in sorted(PRICES_PER_MTOK, key=len, reverse=True):
+        if model.startswith(prefix):
+            input_price, output_price = PRICES_PER_MTOK[prefix]
+            return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+    return 0.0
+
+
+_ids = itertools.count(1)
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'start', 'end', 'attributes', 'report')
+
+    def __init__(self, name: str, kind: str, parent: Optional['Span'], attributes: Dict[str, Any]):
+        self.span_id = f"{os.getpid():x}-{next(_ids):x}"
+        self.trace_id = parent.trace_id if parent else self.span_id
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.kind = kind
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+        self.report: Optional[Dict[str, Any]] = None
+
+    @property
+    def duration(self) -> float:
+        return ((self.end or time.time()) - self.start)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'type': 'span',
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'start': self.start,
+            'end': self.end,
+            'duration_ms': round(self.duration * 1000, 3),
+            **self.attributes
+        }
+
+
+class _NullSpan:
+    """Stand-in handed out when tracing is disabled."""
+    report = None
+
+    def set(self, **attributes):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+def critical_path(spans: List[Span]) -> List[Span]:
+    """
+    Spans that determined the trace's wall-clock time, in start order.
+
+    Starting at the root, the child that finished last is on the path;
+    before it, whichever sibling finished last before that child started,
+    and so on. Step spans with a 'depends_on' attribute only look back
+    through the steps they depend on. Each chosen child is expanded the
+    same way.
+    """
+    children: Dict[Optional[str], List[Span]] = {}
+    for span in spans:
+        children.setdefault(span.parent_id, []).append(span)
+
+    def walk(span: Span) -> List[Span]:
+        chain: List[Span] = []
+        cursor = span.end or time.time()
+        for child in sorted(children.get(span.span_id, []), key=lambda s: s.end or 0, reverse=True):
+            if child.end is None or child.end > cursor:
+                continue
+            if chain and 'step_id' in child.attributes and 'depends_on' in chain[-1].attributes:
+                if child.attributes['step_id'] not in chain[-1].attributes['depends_on']:
+                    continue
+            chain.append(child)
+            cursor = child.start
+        path = [span]
+        for child in reversed(chain):
+            path.extend(walk(child))
+        return path
+
+    roots = children.get(None, [])
+    return walk(roots[0]) if roots else []
+
+
+def build_report(spans: List[Span]) -> Dict[str, Any]:
+    root = next(span for span in spans if span.parent_id is None)
+    llm_calls = [span for span in spans if span.kind == 'llm']
+
+    input_tokens = sum(span.attributes.get('input_tokens', 0) for span in llm_calls)
+    output_tokens = sum(span.attributes.get('output_tokens', 0) for span in llm_calls)
+    path = critical_path(spans)
+
+    return {
+        'type': 'run',
+        'trace_id': root.trace_id,
+        'name': root.name,
+        'duration_ms': round(root.duration * 1000, 3),
+        'llm_calls': len(llm_calls),
+        'cache_hits': sum(1 for span in llm_calls if span.attributes.get('cache_hit')),
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'cost_usd': round(sum(span.attributes.get('cost_usd', 0.0) for span in llm_calls), 6),
+        'queue_wait_ms': round(sum(span.attributes.get('queue_wait_ms', 0.0) for span in llm_calls), 3),
+        'critical_path': [
+            {
+                'name': span.name,
+                'kind': span.kind,
+                'duration_ms': round(span.duration * 1000, 3),
+                **({'step_id': span.attributes['step_id']} if 'step_id' in span.attributes else {})
+            }
+            for span in path if span is not root
+        ]
+    }
+
+
+class _JsonlWriter:
+    """Appends lines to a file from a daemon thread."""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._queue: 'queue.SimpleQueue[Optional[List[str]]]' = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name='trace-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, lines: List[str]):
+        self._queue.put(lines)
+
+    def _run(self):
+        with open(self.path, 'a') as f:
+            while True:
+                lines = self._queue.get()
+                if lines is None:
+                    break
+                f.write(''.join(lines))
+                f.flush()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+class Tracer:
+    """
+    Records spans and reports on every trace once its root span ends.
+
+    Args:
+        path: JSONL file that spans and run reports are appended to
+        enabled: When False, span() hands out a no-op span
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]] = None, enabled: bool = True):
+        self.enabled = enabled
+        self._writer = _JsonlWriter(path) if path and enabled else None
+        self._traces: Dict[str, List[Span]] = {}
+        # Spans nest only under spans of the same tracer. With one shared
+        # variable, a second orchestrator called from a step would parent
+        # its root span on ours, never finish its trace and leak its spans
+        self._current: ContextVar[Optional[Span]] = ContextVar(f'current_span_{id(self):x}', default=None)
+
+    def span(self, name: str, kind: str = 'internal', **attributes):
+        """Context manager for a span under the current one (or a new trace)."""
+        if not self.enabled:
+            return nullcontext(NULL_SPAN)
+        return self._span(name, kind, attributes)
+
+    @contextmanager
+    def _span(self, name: str, kind: str, attributes: Dict[str, Any]) -> Iterator[Span]:
+        span = Span(name, kind, self._current.get(), attributes)
+        self._traces.setdefault(span.trace_id, []).append(span)
+        token = self._current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.attributes['error'] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end = time.time()
+            self._current.reset(token)
+            if span.parent_id is None:
+                self._finish(span)
+
+    def _finish(self, root: Span):
+        spans = self._traces.pop(root.trace_id, [])
+        root.report = build_report(spans)
+        if self._writer is not None:
+            lines = [json.dumps(span.to_dict(), default=str) + '\n' for span in spans]
+            lines.append(json.dumps(root.report) + '\n')
+            self._writer.write(lines)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
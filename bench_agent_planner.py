@@ -0,0 +1,576 @@
+"""
+Benchmarks for the agent orchestrator against a local fake LLM server.
+
+FakeLLMServer speaks enough of the Anthropic Messages and OpenAI Chat
+Completions HTTP APIs (including SSE streaming) for the real SDK clients
+to talk to it, with seeded latency distributions, token rates and error
+injection. No tokens are spent and runs are repeatable.
+
+Scenarios drive execute_task, multi_agent_collaboration and
+_synthesize_results at varying plan sizes and concurrency levels and
+report throughput, p50/p99 latency and event-loop blocking time. The
+startup scenario times `import agent_planner` and the first provider
+construction in fresh interpreters and checks them against a budget.
+
+Usage:
+    python bench_agent_planner.py                  # full matrix
+    python bench_agent_planner.py --quick          # smoke run
+    python bench_agent_planner.py --latency lognormal:200:0.4 --error-rate 0.02 --output bench.json
+    python bench_agent_planner.py --startup-only   # cold-start budget check
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from agent_planner import AgentOrchestrator
+from agent_providers import close_providers
+
+
+PLAN_MARKER = 'step-by-step plan'
+
+# Cold-start budget for `import agent_planner`, over a bare interpreter
+STARTUP_BUDGET_MS = 150.0
+
+# Runs in a fresh interpreter; prints import and first-use timings as JSON
+STARTUP_PROBE = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+import agent_planner
+imported = time.perf_counter()
+heavy = sorted(name for name in ('anthropic', 'openai', 'tiktoken') if name in sys.modules)
+orchestrator = agent_planner.AgentOrchestrator({'cache': False})
+constructed = time.perf_counter()
+
+async def first_use():
+    begin = time.perf_counter()
+    await orchestrator._provider(sys.argv[1])
+    return time.perf_counter() - begin
+
+first = asyncio.run(first_use())
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'init_ms': (constructed - imported) * 1000,
+    'first_use_ms': first * 1000,
+    'heavy_modules_at_import': heavy,
+}))
+"""
+
+
+def parse_latency(spec: str) -> Tuple[str, List[float]]:
+    """'const:MS', 'uniform:LOW_MS:HIGH_MS' or 'lognormal:MEDIAN_MS:SIGMA'."""
+    kind, *args = spec.split(':')
+    if kind not in ('const', 'uniform', 'lognormal'):
+        raise ValueError(f"Unknown latency distribution: {spec}")
+    return kind, [float(arg) for arg in args]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class FakeLLMServer:
+    """
+    Anthropic/OpenAI-compatible HTTP server running on its own thread.
+
+    Args:
+        latency: Time to first token, see parse_latency
+        tokens_per_second: Output generation rate after the first token
+        output_tokens: Approximate length of every reply
+        error_rate: Share of requests answered with a 500
+        rate_limit_rate: Share of requests answered with a 429 + retry-after
+        plan_steps: Steps in the plan returned for planning prompts
+        plan_width: Steps per dependency layer of that plan
+        seed: Seed for every random draw. Latency depends only on the seed
+            and the request body; injected errors follow one seeded sequence
+            so that retries of a failed request can succeed.
+    """
+
+    def __init__(
+        self,
+        latency: str = 'lognormal:50:0.5',
+        tokens_per_second: float = 2000.0,
+        output_tokens: int = 200,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        plan_steps: int = 4,
+        plan_width: int = 4,
+        seed: int = 0
+    ):
+        self.latency = parse_latency(latency)
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.plan_steps = plan_steps
+        self.plan_width = plan_width
+        self.seed = seed
+        self.requests = 0
+        self._errors = random.Random(seed)
+        self._writers = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.base_events.Server] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> int:
+        """Start serving on a free localhost port and return the port."""
+        ready = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, '127.0.0.1', 0)
+            )
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=serve, name='fake-llm-server', daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self._server.sockets[0].getsockname()[1]
+
+    def stop(self):
+        if self._loop is None:
+            return
+
+        async def shutdown():
+            self._server.close()
+            # Closing the sockets lets every connection handler return on its own
+            for writer in list(self._writers):
+                writer.close()
+            handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            if handlers:
+                await asyncio.wait(handlers, timeout=1)
+            self._loop.stop()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop)
+        self._thread.join()
+        self._loop.close()
+
+    def _random(self, body: bytes) -> random.Random:
+        return random.Random(hashlib.sha256(body).hexdigest() + str(self.seed))
+
+    def _first_token_delay(self, rng: random.Random) -> float:
+        kind, args = self.latency
+        if kind == 'const':
+            ms = args[0]
+        elif kind == 'uniform':
+            ms = rng.uniform(args[0], args[1])
+        else:
+            ms = rng.lognormvariate(0, args[1]) * args[0]
+        return ms / 1000
+
+    def _plan(self) -> str:
+        steps = []
+        for i in range(self.plan_steps):
+            layer_start = (i // self.plan_width) * self.plan_width
+            previous_layer = range(max(0, layer_start - self.plan_width), layer_start)
+            steps.append({
+                'id': str(i + 1),
+                'action': ('analyze', 'generate', 'research')[i % 3],
+                'description': f"Benchmark step {i + 1}",
+                'depends_on': [str(j + 1) for j in previous_layer]
+            })
+        return json.dumps(steps)
+
+    def _reply(self, prompt: str) -> str:
+        if PLAN_MARKER in prompt:
+            return self._plan()
+        return ' '.join(['lorem'] * self.output_tokens)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                path = request_line.split()[1].decode()
+                await self._respond(path, body, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _respond(self, path: str, body: bytes, writer: asyncio.StreamWriter):
+        self.requests += 1
+        anthropic_api = path.endswith('/messages')
+        request = json.loads(body or b'{}')
+        rng = self._random(body)
+
+        roll = self._errors.random()
+        if roll < self.rate_limit_rate + self.error_rate:
+            if roll < self.rate_limit_rate:
+                self._send_error(writer, 429, 'rate_limit_error', anthropic_api, {'retry-after': '0.05'})
+            else:
+                self._send_error(writer, 500, 'api_error', anthropic_api)
+            await writer.drain()
+            return
+
+        prompt = request['messages'][-1]['content']
+        text = self._reply(prompt)
+        words = text.split(' ')
+        input_tokens = len(json.dumps(request['messages'])) // 4
+
+        await asyncio.sleep(self._first_token_delay(rng))
+
+        if not request.get('stream'):
+            await asyncio.sleep(len(words) / self.tokens_per_second)
+            if anthropic_api:
+                payload = {
+                    'id': 'msg_bench', 'type': 'message', 'role': 'assistant',
+                    'model': request['model'], 'stop_reason': 'end_turn', 'stop_sequence': None,
+                    'content': [{'type': 'text', 'text': text}],
+                    'usage': {'input_tokens': input_tokens, 'output_tokens': len(words)}
+                }
+            else:
+                payload = {
+                    'id': 'chatcmpl-bench', 'object': 'chat.completion', 'created': 0,
+                    'model': request['model'],
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': text}}],
+                    'usage': {'prompt_tokens': input_tokens, 'completion_tokens': len(words),
+                              'total_tokens': input_tokens + len(words)}
+                }
+            data = json.dumps(payload).encode()
+            writer.write(
+                b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                b'Content-Length: ' + str(len(data)).encode() + b'\r\n\r\n' + data
+            )
+            await writer.drain()
+            return
+
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n')
+
+        def event(name: Optional[str], payload: Any):
+            data = json.dumps(payload) if not isinstance(payload, str) else payload
+            chunk = (f"event: {name}\n" if name else '') + f"data: {data}\n\n"
+            raw = chunk.encode()
+            writer.write(b'%x\r\n' % len(raw) + raw + b'\r\n')
+
+        if anthropic_api:
+            event('message_start', {'type': 'message_start', 'message': {
+                'id': 'msg_bench', 'type': 'message', 'role': 'assistant', 'model': request['model'],
+                'content': [], 'stop_reason': None, 'stop_sequence': None,
+                'usage': {'input_tokens': input_tokens, 'output_tokens': 0}}})
+            event('content_block_start', {'type': 'content_block_start', 'index': 0,
+                                          'content_block': {'type': 'text', 'text': ''}})
+
+        for start in range(0, len(words), 10):
+            piece = ' '.join(words[start:start + 10]) + (' ' if start + 10 < len(words) else '')
+            if anthropic_api:
+                event('content_block_delta', {'type': 'content_block_delta', 'index': 0,
+                                              'delta': {'type': 'text_delta', 'text': piece}})
+            else:
+                event(None, {'id': 'chatcmpl-bench', 'object': 'chat.completion.chunk', 'created': 0,
+                             'model': request['model'],
+                             'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]})
+            await writer.drain()
+            await asyncio.sleep(min(10, len(words) - start) / self.tokens_per_second)
+
+        if anthropic_api:
+            event('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+            event('message_delta', {'type': 'message_delta',
+                                    'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                                    'usage': {'output_tokens': len(words)}})
+            event('message_stop', {'type': 'message_stop'})
+        else:
+            event(None, {'id': 'chatcmpl-bench', 'object': 'chat.completion.chunk', 'created': 0,
+                         'model': request['model'], 'choices': [],
+                         'usage': {'prompt_tokens': input_tokens, 'completion_tokens': len(words),
+                                   'total_tokens': input_tokens + len(words)}})
+            event(None, '[DONE]')
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+    def _send_error(
+        self,
+        writer: asyncio.StreamWriter,
+        status: int,
+        kind: str,
+        anthropic_api: bool,
+        headers: Optional[Dict[str, str]] = None
+    ):
+        if anthropic_api:
+            payload = {'type': 'error', 'error': {'type': kind, 'message': 'injected'}}
+        else:
+            payload = {'error': {'type': kind, 'message': 'injected', 'code': None, 'param': None}}
+        data = json.dumps(payload).encode()
+        reason = {429: 'Too Many Requests', 500: 'Internal Server Error'}[status]
+        extra = ''.join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n{extra}"
+            f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+        )
+
+
+class LoopLagMonitor:
+    """
+    Measures how long the event loop was blocked.
+
+    A ticker sleeps `interval` seconds at a time; any extra delay before it
+    wakes up is time the loop spent unable to run ready callbacks.
+    """
+
+    def __init__(self, interval: float = 0.005, threshold: float = 0.001):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _tick(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def __enter__(self):
+        self._task = asyncio.get_running_loop().create_task(self._tick())
+        return self
+
+    def __exit__(self, *exc_info):
+        self._task.cancel()
+
+    @property
+    def blocked_seconds(self) -> float:
+        return sum(lag for lag in self.lags if lag > self.threshold)
+
+    @property
+    def max_lag(self) -> float:
+        return max(self.lags, default=0.0)
+
+
+def orchestrator_for(port: int, max_concurrency: int, config: Optional[Dict[str, Any]] = None) -> AgentOrchestrator:
+    return AgentOrchestrator({
+        'anthropic_key': 'bench',
+        'openai_key': 'bench',
+        'anthropic_base_url': f'http://127.0.0.1:{port}',
+        'openai_base_url': f'http://127.0.0.1:{port}/v1',
+        'cache': False,
+        'max_concurrency': max_concurrency,
+        'rate_limits': {
+            'anthropic': {'max_concurrency': 1024},
+            'openai': {'max_concurrency': 1024},
+        },
+        **(config or {})
+    })
+
+
+async def measure(name: str, params: Dict[str, Any], runs: int, call) -> Dict[str, Any]:
+    """Run `call(i)` for i in range(runs) concurrently and summarize timings."""
+    latencies: List[float] = []
+    failures = 0
+
+    async def timed(i: int):
+        nonlocal failures
+        started = time.perf_counter()
+        try:
+            outcome = await call(i)
+            if isinstance(outcome, dict) and outcome.get('status') not in (None, 'completed'):
+                failures += 1
+        except Exception:
+            failures += 1
+        latencies.append(time.perf_counter() - started)
+
+    with LoopLagMonitor() as monitor:
+        started = time.perf_counter()
+        await asyncio.gather(*(timed(i) for i in range(runs)))
+        wall = time.perf_counter() - started
+
+    await close_providers()
+    return {
+        'scenario': name,
+        **params,
+        'runs': runs,
+        'failures': failures,
+        'wall_s': round(wall, 4),
+        'throughput_per_s': round(runs / wall, 3),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+        'loop_blocked_ms': round(monitor.blocked_seconds * 1000, 2),
+        'loop_max_lag_ms': round(monitor.max_lag * 1000, 2),
+    }
+
+
+async def bench_execute_task(server: FakeLLMServer, port: int, plan_steps: int, concurrency: int,
+                             tasks: int, stream: bool = False) -> Dict[str, Any]:
+    server.plan_steps = plan_steps
+    orchestrator = orchestrator_for(port, concurrency)
+
+    async def call(i: int):
+        if not stream:
+            return await orchestrator.execute_task(f"benchmark task {i}")
+        async for event in orchestrator.execute_task_stream(f"benchmark task {i}"):
+            if event['type'] == 'result':
+                return event['result']
+
+    requests_before = server.requests
+    result = await measure(
+        'execute_task_stream' if stream else 'execute_task',
+        {'plan_steps': plan_steps, 'max_concurrency': concurrency, 'tasks_in_flight': tasks},
+        tasks, call
+    )
+    result['provider_requests'] = server.requests - requests_before
+    return result
+
+
+async def bench_multi_agent(server: FakeLLMServer, port: int, replicas: int, runs: int) -> Dict[str, Any]:
+    orchestrator = orchestrator_for(port, 4)
+
+    async def call(i: int):
+        return await orchestrator.multi_agent_collaboration(
+            f"benchmark collaboration {i}",
+            replicas={'validator': {'n': replicas, 'mode': 'first_k', 'k': 1}}
+        )
+
+    requests_before = server.requests
+    result = await measure('multi_agent_collaboration', {'replicas': replicas}, runs, call)
+    result['provider_requests'] = server.requests - requests_before
+    return result
+
+
+async def bench_synthesize(server: FakeLLMServer, port: int, steps: int, step_chars: int, runs: int) -> Dict[str, Any]:
+    orchestrator = orchestrator_for(port, 4)
+    outputs = [{'output': f"Result {i}: " + 'data ' * (step_chars // 5)} for i in range(steps)]
+
+    async def call(i: int):
+        return await orchestrator._synthesize_results(outputs + [{'output': f"run {i}"}])
+
+    requests_before = server.requests
+    result = await measure('synthesize_results', {'steps': steps, 'step_chars': step_chars}, runs, call)
+    result['provider_requests'] = server.requests - requests_before
+    return result
+
+
+def bench_startup(provider: str, runs: int, budget_ms: float) -> Dict[str, Any]:
+    """Time imports and first provider use, each in a fresh interpreter."""
+    # The probe imports agent_planner from this directory, wherever we are run from
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package_dir, os.environ.get('PYTHONPATH')])))
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', STARTUP_PROBE, provider],
+            env=env, check=True, capture_output=True, text=True
+        ).stdout
+        samples.append(json.loads(output))
+
+    import_ms = [sample['import_ms'] for sample in samples]
+    return {
+        'scenario': 'startup',
+        'provider': provider,
+        'runs': runs,
+        'p50_ms': round(percentile(import_ms, 50), 2),
+        'p99_ms': round(percentile(import_ms, 99), 2),
+        'init_ms': round(statistics.median(sample['init_ms'] for sample in samples), 2),
+        'first_use_ms': round(statistics.median(sample['first_use_ms'] for sample in samples), 2),
+        'heavy_modules_at_import': samples[-1]['heavy_modules_at_import'],
+        'budget_ms': budget_ms,
+        'within_budget': percentile(import_ms, 50) <= budget_ms
+    }
+
+
+def run_startup(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    runs = 3 if args.quick else 10
+    return [bench_startup(provider, runs, args.startup_budget_ms) for provider in ('anthropic', 'openai')]
+
+
+async def run_suite(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    server = FakeLLMServer(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        output_tokens=args.output_tokens,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        plan_width=args.plan_width,
+        seed=args.seed
+    )
+    port = server.start()
+
+    if args.quick:
+        plan_sizes, concurrencies, replica_counts, synth_sizes = [4], [4], [1, 3], [8]
+    else:
+        plan_sizes, concurrencies, replica_counts, synth_sizes = [2, 4, 8, 16], [1, 4, 16], [1, 3, 5], [4, 16, 64]
+
+    results = []
+    try:
+        for plan_steps in plan_sizes:
+            for concurrency in concurrencies:
+                results.append(await bench_execute_task(server, port, plan_steps, concurrency, args.tasks))
+        results.append(await bench_execute_task(server, port, plan_sizes[-1], concurrencies[-1], args.tasks, stream=True))
+        for replicas in replica_counts:
+            results.append(await bench_multi_agent(server, port, replicas, args.tasks))
+        for steps in synth_sizes:
+            results.append(await bench_synthesize(server, port, steps, args.step_chars, args.tasks))
+    finally:
+        server.stop()
+
+    return results
+
+
+def print_table(results: List[Dict[str, Any]]):
+    columns = ['scenario', 'plan_steps', 'max_concurrency', 'replicas', 'steps',
+               'throughput_per_s', 'p50_ms', 'p99_ms', 'loop_blocked_ms', 'failures', 'first_use_ms']
+    print('  '.join(f"{column:>16}" for column in columns), file=sys.stderr)
+    for row in results:
+        print('  '.join(f"{str(row.get(column, '')):>16}" for column in columns), file=sys.stderr)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the agent orchestrator against a fake LLM server.')
+    parser.add_argument('--quick', action='store_true', help='Run a small smoke matrix')
+    parser.add_argument('--tasks', type=int, default=8, help='Concurrent runs per scenario')
+    parser.add_argument('--latency', default='lognormal:50:0.5')
+    parser.add_argument('--tokens-per-second', type=float, default=2000.0)
+    parser.add_argument('--output-tokens', type=int, default=200)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--plan-width', type=int, default=4, help='Independent steps per plan layer')
+    parser.add_argument('--step-chars', type=int, default=20000, help='Output size per step for synthesis runs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write JSON results here instead of stdout')
+    parser.add_argument('--startup-only', action='store_true', help='Only run the cold-start scenario')
+    parser.add_argument('--startup-budget-ms', type=float, default=STARTUP_BUDGET_MS,
+                        help='Median import time above which the run exits non-zero')
+    args = parser.parse_args(argv)
+
+    results = run_startup(args)
+    if not args.startup_only:
+        results += asyncio.run(run_suite(args))
+    print_table(results)
+
+    report = json.dumps({'params': vars(args), 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+    return 0 if all(row.get('within_budget', True) for row in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
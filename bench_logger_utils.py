@@ -0,0 +1,521 @@
+"""
+Benchmarks for logger_utils.
+
+Formatter scenarios compare StructuredFormatter against the previous
+implementation (kept here as LegacyStructuredFormatter) on identical
+pre-built records, with the standard-library and orjson JSON backends,
+and report records per second.
+
+Handler scenarios log through a real logger into one handler type
+(console, rotating_file, structured_json, remote, aggregator) from
+several threads and processes at once, with and without log_with_context
+extras, and report aggregate records per second and per-call latency.
+The remote handler posts to a local stand-in service and the aggregator
+scenario runs a LogAggregator child process, so nothing leaves the host.
+
+The import scenario times `import logger_utils` and the first use of
+default_logger, each in a fresh interpreter.
+
+Usage:
+    python bench_logger_utils.py                  # everything, full matrix
+    python bench_logger_utils.py --quick          # smoke run
+    python bench_logger_utils.py --suite handlers --handlers remote,console
+    python bench_logger_utils.py --output bench.json
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from array import array
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import log_aggregator
+from logger_utils import RemoteLogHandler, StructuredFormatter, _stdlib_dumps, log_with_context
+
+
+HANDLER_SCENARIOS = ('console', 'rotating_file', 'structured_json', 'remote', 'aggregator')
+
+CONSOLE_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Runs in a fresh interpreter (in an empty directory, since default_logger
+# creates ./logs); prints import and first-use timings as JSON
+IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import logger_utils
+imported = time.perf_counter()
+logger_utils.default_logger
+ready = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'default_logger_ms': (ready - imported) * 1000,
+    'requests_at_import': 'requests' in sys.modules,
+}))
+"""
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class LegacyStructuredFormatter(logging.Formatter):
+    """StructuredFormatter as it was before the fast path, for comparison."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        log_data = {
+            'timestamp': datetime.utcnow().isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'function': record.funcName,
+            'line': record.lineno
+        }
+
+        if record.exc_info:
+            log_data['exception'] = {
+                'type': record.exc_info[0].__name__,
+                'message': str(record.exc_info[1]),
+                'traceback': traceback.format_exception(*record.exc_info)
+            }
+
+        if hasattr(record, 'user_id'):
+            log_data['user_id'] = record.user_id
+        if hasattr(record, 'request_id'):
+            log_data['request_id'] = record.request_id
+
+        return json.dumps(log_data)
+
+
+def make_records(count: int, message_bytes: int, extras: bool) -> List[logging.LogRecord]:
+    padding = 'x' * max(0, message_bytes - 20)
+    records = []
+    for i in range(count):
+        record = logging.LogRecord(
+            'bench', logging.INFO, __file__, 42, 'request %d handled %s', (i, padding), None, func='handle'
+        )
+        if extras:
+            record.user_id = i % 1000
+            record.request_id = f'req-{i:08d}'
+        records.append(record)
+    return records
+
+
+def stdlib_backend(formatter: StructuredFormatter) -> StructuredFormatter:
+    formatter._dumps = _stdlib_dumps()
+    return formatter
+
+
+def bench_formatter(
+    name: str,
+    make_formatter: Callable[[], logging.Formatter],
+    records: List[logging.LogRecord],
+    repeat: int,
+    params: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Best of `repeat` passes over the same records."""
+    formatter = make_formatter()
+    for record in records[:1000]:
+        formatter.format(record)
+
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for record in records:
+            formatter.format(record)
+        best = min(best, time.perf_counter() - started)
+
+    return {
+        'scenario': 'formatter',
+        'formatter': name,
+        **params,
+        'records': len(records),
+        'records_per_s': round(len(records) / best),
+        'us_per_record': round(best / len(records) * 1e6, 3)
+    }
+
+
+def run_formatters(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    count = 20000 if args.quick else 200000
+    formatters = {
+        'legacy': LegacyStructuredFormatter,
+        'structured_stdlib_json': lambda: stdlib_backend(StructuredFormatter()),
+        'structured': StructuredFormatter,
+    }
+
+    results = []
+    for message_bytes in ([100] if args.quick else [100, 1000]):
+        for extras in (False, True):
+            records = make_records(count, message_bytes, extras)
+            params = {'message_bytes': message_bytes, 'extras': extras}
+            rows = [
+                bench_formatter(name, make, records, args.repeat, params)
+                for name, make in formatters.items()
+            ]
+            baseline = rows[0]['records_per_s']
+            for row in rows:
+                row['speedup'] = round(row['records_per_s'] / baseline, 2)
+            # Both backends must write the same bytes for the same record
+            stdlib, fast = stdlib_backend(StructuredFormatter()), StructuredFormatter()
+            identical = all(stdlib.format(record) == fast.format(record) for record in records[:1000])
+            for row in rows[1:]:
+                row['identical_output'] = identical
+            results += rows
+    return results
+
+
+class FakeLogService:
+    """Stand-in for the remote log service on a local thread; counts what arrives."""
+
+    def __init__(self):
+        self.received = 0
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def start(self) -> str:
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                with service._lock:
+                    service.received += len(json.loads(body)['logs'])
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def _serve_aggregator(address: str, log_dir: str):
+    # The aggregator's console handler binds sys.stdout when it is created
+    sys.stdout = open(os.devnull, 'w')
+    log_aggregator._serve(address, 'bench.aggregated', {'log_dir': log_dir})
+
+
+def start_aggregator(address: str, log_dir: str, timeout: float = 10.0) -> multiprocessing.Process:
+    process = multiprocessing.Process(target=_serve_aggregator, args=(address, log_dir), daemon=True)
+    process.start()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            log_aggregator._connect(address, timeout=1.0).close()
+            return process
+        except OSError:
+            if not process.is_alive() or time.monotonic() > deadline:
+                process.terminate()
+                raise RuntimeError('log aggregator did not start')
+            time.sleep(0.02)
+
+
+def make_handler(kind: str, directory: str, service_url: str, aggregator_address: str) -> logging.Handler:
+    """One handler of the given scenario, configured as setup_logger would."""
+    if kind == 'console':
+        # os.devnull rather than a terminal, whose speed would dominate
+        handler = logging.StreamHandler(open(os.devnull, 'w'))
+        handler.setFormatter(logging.Formatter(CONSOLE_FORMAT, datefmt='%Y-%m-%d %H:%M:%S'))
+    elif kind in ('rotating_file', 'structured_json'):
+        # One file per process; RotatingFileHandler is not multi-process safe
+        handler = RotatingFileHandler(
+            Path(directory) / f'{kind}-{os.getpid()}.log', maxBytes=10 * 1024 * 1024, backupCount=2
+        )
+        if kind == 'structured_json':
+            handler.setFormatter(StructuredFormatter())
+        else:
+            handler.setFormatter(logging.Formatter(CONSOLE_FORMAT, datefmt='%Y-%m-%d %H:%M:%S'))
+    elif kind == 'remote':
+        handler = RemoteLogHandler(api_key='bench', service_url=service_url, batch_size=100, flush_interval=0.2)
+    elif kind == 'aggregator':
+        handler = log_aggregator.AggregatorHandler(aggregator_address)
+    else:
+        raise ValueError(f"unknown handler scenario {kind!r}")
+    return handler
+
+
+def _log_thread(
+    logger: logging.Logger,
+    level: int,
+    count: int,
+    padding: str,
+    context: bool,
+    latencies: array,
+    barrier: threading.Barrier
+):
+    log = logger.log
+    clock = time.perf_counter_ns
+
+    def loop():
+        for i in range(count):
+            started = clock()
+            log(level, 'request %d handled %s', i, padding)
+            latencies.append(clock() - started)
+
+    barrier.wait()
+    if context:
+        with log_with_context(logger, request_id=f'req-{threading.get_ident()}', user_id=42):
+            loop()
+    else:
+        loop()
+
+
+def _run_worker(
+    kind: str,
+    threads: int,
+    count: int,
+    message_bytes: int,
+    context: bool,
+    directory: str,
+    service_url: str,
+    aggregator_address: str,
+    start_barrier=None
+) -> Dict[str, Any]:
+    """Log count records from each of `threads` threads; timings as wall-clock times."""
+    logger = logging.getLogger(f'bench.{kind}.{os.getpid()}')
+    logger.handlers.clear()
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = make_handler(kind, directory, service_url, aggregator_address)
+    logger.addHandler(handler)
+
+    # RemoteLogHandler only ships ERROR and above
+    level = logging.ERROR if kind == 'remote' else logging.INFO
+    padding = 'x' * max(0, message_bytes - 20)
+    barrier = threading.Barrier(threads + 1)
+    samples = [array('q') for _ in range(threads)]
+    workers = [
+        threading.Thread(target=_log_thread, args=(logger, level, count, padding, context, samples[i], barrier))
+        for i in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    if start_barrier is not None:
+        start_barrier.wait()
+    barrier.wait()
+    started = time.time()
+    for worker in workers:
+        worker.join()
+    finished = time.time()
+    handler.close()
+    drained = time.time()
+    logger.removeHandler(handler)
+
+    return {
+        'started': started,
+        'finished': finished,
+        'drained': drained,
+        'latencies': b''.join(sample.tobytes() for sample in samples),
+        'dropped': getattr(handler, 'dropped', 0)
+    }
+
+
+def _worker_process(results, start_barrier, *args):
+    results.put(_run_worker(*args, start_barrier=start_barrier))
+
+
+def bench_handler(
+    kind: str,
+    threads: int,
+    processes: int,
+    count: int,
+    message_bytes: int,
+    context: bool,
+    directory: str,
+    service: FakeLogService,
+    service_url: str,
+    aggregator_address: str
+) -> Dict[str, Any]:
+    """Aggregate throughput and per-call latency of one handler scenario."""
+    args = (kind, threads, count, message_bytes, context, directory, service_url, aggregator_address)
+    delivered_before = service.received
+    if processes == 1:
+        runs = [_run_worker(*args)]
+    else:
+        results = multiprocessing.Queue()
+        start_barrier = multiprocessing.Barrier(processes)
+        children = [
+            multiprocessing.Process(target=_worker_process, args=(results, start_barrier, *args))
+            for _ in range(processes)
+        ]
+        for child in children:
+            child.start()
+        runs = [results.get() for _ in children]
+        for child in children:
+            child.join()
+
+    records = threads * processes * count
+    started = min(run['started'] for run in runs)
+    window = max(run['finished'] for run in runs) - started
+    drain = max(run['drained'] for run in runs) - started
+    latencies = array('q')
+    for run in runs:
+        latencies.frombytes(run['latencies'])
+    latencies_us = sorted(value / 1000 for value in latencies)
+
+    row = {
+        'scenario': 'handler',
+        'handler': kind,
+        'threads': threads,
+        'processes': processes,
+        'message_bytes': message_bytes,
+        'context': context,
+        'records': records,
+        'records_per_s': round(records / window),
+        # Including the time handlers need to flush or ship on close
+        'drained_per_s': round(records / drain),
+        'p50_us': round(percentile(latencies_us, 50), 2),
+        'p99_us': round(percentile(latencies_us, 99), 2),
+        'max_us': round(latencies_us[-1], 2),
+        'dropped': sum(run['dropped'] for run in runs)
+    }
+    if kind == 'remote':
+        row['delivered'] = service.received - delivered_before
+    return row
+
+
+def run_handlers(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    if args.quick:
+        count, thread_counts, process_counts, sizes = 1000, [1, 2], [1, 2], [100]
+    else:
+        count, thread_counts, process_counts, sizes = 5000, [1, 4], [1, 4], [100, 2000]
+
+    service = FakeLogService()
+    service_url = service.start()
+    results = []
+    with tempfile.TemporaryDirectory(prefix='bench-log-') as directory:
+        aggregator_address = os.path.join(directory, 'aggregator.sock')
+        aggregator = start_aggregator(aggregator_address, directory) if 'aggregator' in args.handlers else None
+        try:
+            for kind in args.handlers:
+                for processes in process_counts:
+                    for threads in thread_counts:
+                        for message_bytes in sizes:
+                            for context in (False, True):
+                                results.append(bench_handler(
+                                    kind, threads, processes, count, message_bytes, context,
+                                    directory, service, service_url, aggregator_address
+                                ))
+        finally:
+            service.stop()
+            if aggregator is not None:
+                aggregator.terminate()
+                aggregator.join()
+    return results
+
+
+def bench_import(runs: int) -> Dict[str, Any]:
+    """Time importing logger_utils and first using default_logger, each in a fresh interpreter."""
+    package_dir = str(Path(__file__).resolve().parent)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package_dir, os.environ.get('PYTHONPATH')])))
+    samples = []
+    with tempfile.TemporaryDirectory(prefix='bench-import-') as cwd:
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, '-c', IMPORT_PROBE], cwd=cwd, env=env, check=True, capture_output=True, text=True
+            ).stdout
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    import_ms = [sample['import_ms'] for sample in samples]
+    return {
+        'scenario': 'import',
+        'runs': runs,
+        'import_ms': round(statistics.median(import_ms), 2),
+        'import_min_ms': round(min(import_ms), 2),
+        'default_logger_ms': round(statistics.median(sample['default_logger_ms'] for sample in samples), 2),
+        'requests_at_import': samples[-1]['requests_at_import']
+    }
+
+
+TABLE_COLUMNS = {
+    'formatter': ['formatter', 'message_bytes', 'extras', 'records_per_s', 'us_per_record', 'speedup'],
+    'handler': ['handler', 'processes', 'threads', 'message_bytes', 'context', 'records_per_s',
+                'drained_per_s', 'p50_us', 'p99_us', 'dropped'],
+    'import': ['runs', 'import_ms', 'import_min_ms', 'default_logger_ms', 'requests_at_import'],
+}
+
+
+def print_table(results: List[Dict[str, Any]]):
+    scenario = None
+    for row in results:
+        columns = TABLE_COLUMNS[row['scenario']]
+        if row['scenario'] != scenario:
+            scenario = row['scenario']
+            print(f"\n[{scenario}]", file=sys.stderr)
+            print('  '.join(f"{column:>18}" for column in columns), file=sys.stderr)
+        print('  '.join(f"{str(row.get(column, '')):>18}" for column in columns), file=sys.stderr)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark logger_utils formatters and handlers.')
+    parser.add_argument('--quick', action='store_true', help='Run a small smoke matrix')
+    parser.add_argument('--suite', choices=('all', 'formatters', 'handlers', 'import'), default='all')
+    parser.add_argument('--handlers', default=','.join(HANDLER_SCENARIOS),
+                        help=f"Comma-separated subset of {', '.join(HANDLER_SCENARIOS)}")
+    parser.add_argument('--repeat', type=int, default=3, help='Passes per measurement; the best is kept')
+    parser.add_argument('--import-runs', type=int, default=None, help='Fresh interpreters for the import timing')
+    parser.add_argument('--output', help='Write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+    args.handlers = [kind.strip() for kind in args.handlers.split(',') if kind.strip()]
+    for kind in args.handlers:
+        if kind not in HANDLER_SCENARIOS:
+            parser.error(f"unknown handler scenario {kind!r}")
+    if args.import_runs is None:
+        args.import_runs = 3 if args.quick else 10
+
+    results = []
+    if args.suite in ('all', 'import'):
+        results.append(bench_import(args.import_runs))
+    if args.suite in ('all', 'formatters'):
+        results += run_formatters(args)
+    if args.suite in ('all', 'handlers'):
+        results += run_handlers(args)
+    print_table(results)
+
+    report = json.dumps({
+        'params': vars(args),
+        'json_backend': 'orjson' if 'orjson' in sys.modules else 'json',
+        'python': sys.version.split()[0],
+        'cpu_count': os.cpu_count(),
+        'results': results
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,402 @@
+"""
+Multi-process log aggregation.
+
+RotatingFileHandler is not safe to share between processes: each worker
+rolls the file over on its own, so lines interleave or disappear. With an
+aggregator, workers hand their records to one process that owns the log
+files, rotation and remote shipping.
+
+Workers call setup_logger(aggregator_address=...), which gives their logger
+an AggregatorHandler. It queues records like the use_queue mode does and a
+sender thread renders them (StructuredFormatter output included, so JSON
+encoding runs in parallel across workers) and ships them as JSON batches
+over a Unix socket, or TCP where Unix sockets are unavailable. Frames are
+plain data, never unpickled, so a client can at worst write log lines.
+The aggregator handles each batch before reading the next; when it falls
+behind, the socket buffer fills, the sender waits, and the worker's queue
+applies its overflow policy, so backpressure reaches the callers.
+
+    # supervisor / main process
+    aggregator = start_aggregator('/tmp/app-log.sock', name='app', log_dir='logs', enable_remote=True)
+    # each worker
+    logger = setup_logger('app', aggregator_address='/tmp/app-log.sock')
+
+or run the aggregator standalone:
+
+    python log_aggregator.py /tmp/app-log.sock --name app --log-dir logs
+
+Before a worker exits it must drain its queue, or the last records are
+lost: call shutdown_logging() (or logging.shutdown(), or the handler's
+close()). This happens by itself at normal interpreter exit and when a
+multiprocessing.Process or Pool worker returns; processes that leave
+through os._exit or a fork without multiprocessing must call it
+themselves. Stop workers before the aggregator so their last batches are
+written.
+"""
+
+import argparse
+import atexit
+import logging
+import multiprocessing
+import multiprocessing.util
+import os
+import queue
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from logger_utils import BoundedQueueHandler, StructuredFormatter, _json_backend, _listeners, setup_logger, shutdown_logging
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+
+# A Unix socket path, or (host, port) for TCP
+Address = Union[str, Tuple[str, int]]
+
+FRAME = struct.Struct('>I')
+# Larger frames are refused and their connection closed
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+# Record attribute carrying the worker-rendered StructuredFormatter line
+RENDERED_ATTR = '_structured'
+
+_STOP = object()
+
+# Set at interpreter exit, so senders give up on an unreachable aggregator
+# instead of holding up shutdown
+_exiting = threading.Event()
+atexit.register(_exiting.set)
+
+# Process that last registered shutdown_logging with multiprocessing
+_finalizer_pid: Optional[int] = None
+
+
+def _drain_on_worker_exit():
+    """
+    multiprocessing children leave through os._exit, skipping atexit, but
+    run exit-priority finalizers first; drain through one of those. The
+    registration is per process: inherited finalizers are skipped.
+    """
+    global _finalizer_pid
+    if _finalizer_pid != os.getpid():
+        _finalizer_pid = os.getpid()
+        multiprocessing.util.Finalize(None, shutdown_logging, exitpriority=10)
+
+
+def parse_address(address: Union[str, Address]) -> Address:
+    """'host:port' as a (host, port) TCP address; other strings are socket paths."""
+    if isinstance(address, str) and ':' in address and not address.startswith(('/', '.')):
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return address
+
+
+def _connect(address: Address, timeout: Optional[float] = None) -> socket.socket:
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(address)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class AggregatorHandler(BoundedQueueHandler):
+    """
+    Worker side: queues records and ships them to a LogAggregator in batches.
+
+    Args:
+        address: The aggregator's socket path, (host, port) or 'host:port'
+        queue_size / overflow: As for setup_logger's queued mode
+        batch_size: Most records per frame; whatever is queued when the
+            sender wakes goes out together, so batches grow under load
+        reconnect_delay: Pause between attempts while the aggregator is
+            unreachable; the pending batch is kept and resent
+        formatter: Renders the line the aggregator's StructuredFormatter
+            handlers write
+    """
+
+    def __init__(
+        self,
+        address: Address,
+        queue_size: int = 10000,
+        overflow: str = 'block',
+        batch_size: int = 500,
+        reconnect_delay: float = 0.5,
+        formatter: Optional[StructuredFormatter] = None
+    ):
+        super().__init__(queue.Queue(maxsize=queue_size), overflow)
+        self.address = parse_address(address)
+        self.batch_size = batch_size
+        self.reconnect_delay = reconnect_delay
+        self.structured = formatter or StructuredFormatter()
+        # Values JSON cannot represent are sent as str()
+        self._dumps = _json_backend()
+        self.stats = {'sent': 0, 'batches': 0, 'reconnects': 0}
+        self._exc_formatter = logging.Formatter()
+        self._socket: Optional[socket.socket] = None
+        self._closing = threading.Event()
+        self._idle = threading.Condition()
+        self._unsent = 0
+        self._timed_out = False
+        self._thread = threading.Thread(target=self._run, name='log-aggregator-sender', daemon=True)
+        self._thread.start()
+        _drain_on_worker_exit()
+
+    def enqueue(self, record: logging.LogRecord):
+        with self._idle:
+            self._unsent += 1
+        super().enqueue(record)
+
+    def _render(self, record: logging.LogRecord) -> Dict[str, Any]:
+        attributes = dict(record.__dict__)
+        attributes[RENDERED_ATTR] = self.structured.format(record)
+        if record.exc_info:
+            attributes['exc_text'] = record.exc_text or self._exc_formatter.formatException(record.exc_info)
+        attributes['exc_info'] = None
+        attributes['args'] = None
+        return attributes
+
+    def _encode(self, batch: List[logging.LogRecord]) -> bytes:
+        payload = self._dumps([self._render(record) for record in batch]).encode()
+        return FRAME.pack(len(payload)) + payload
+
+    def _send(self, frame: bytes) -> bool:
+        """Deliver one frame, reconnecting as needed; False once closing or exiting."""
+        while True:
+            if self._socket is None and (self._closing.is_set() or _exiting.is_set()):
+                return False
+            try:
+                if self._socket is None:
+                    self._socket = _connect(self.address)
+                self._socket.sendall(frame)
+                return True
+            except OSError:
+                if self._socket is not None:
+                    self._socket.close()
+                    self._socket = None
+                self.stats['reconnects'] += 1
+                if self._closing.wait(self.reconnect_delay):
+                    return False
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = any(record is _STOP for record in batch)
+            batch = [record for record in batch if record is not _STOP]
+            if batch:
+                if self._send(self._encode(batch)):
+                    self.stats['sent'] += len(batch)
+                    self.stats['batches'] += 1
+                with self._idle:
+                    self._unsent -= len(batch)
+                    self._idle.notify_all()
+            if stop:
+                return
+
+    def flush(self, timeout: Optional[float] = 5.0):
+        """
+        Wait until every queued record has been sent or given up on, at
+        most `timeout` seconds (None waits indefinitely). logging.shutdown
+        calls this with the default, so exit never hangs on an
+        unreachable aggregator.
+        """
+        with self._idle:
+            done = self._idle.wait_for(lambda: self._unsent - self.dropped <= 0 or not self._thread.is_alive(), timeout)
+        self._timed_out = not done
+
+    def close(self):
+        if self._thread.is_alive():
+            if not self._timed_out:
+                # logging.shutdown flushes right before closing; don't wait twice
+                self.flush()
+            self._closing.set()
+            self.queue.put(_STOP)
+            self._thread.join(timeout=5.0)
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        super().close()
+
+
+class _PreformattedFormatter(logging.Formatter):
+    """Writes the worker-rendered line when there is one."""
+
+    def __init__(self, formatter: logging.Formatter):
+        super().__init__()
+        self.formatter = formatter
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = record.__dict__.get(RENDERED_ATTR)
+        return line if line is not None else self.formatter.format(record)
+
+
+class _BatchHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        aggregator: 'LogAggregator' = self.server.aggregator
+        stream = self.request.makefile('rb')
+        while True:
+            header = stream.read(FRAME.size)
+            if len(header) < FRAME.size:
+                return
+            (length,) = FRAME.unpack(header)
+            if length > MAX_FRAME_BYTES:
+                return
+            payload = stream.read(length)
+            if len(payload) < length:
+                return
+            try:
+                batch = _json_loads(payload)
+            except ValueError:
+                return
+            if isinstance(batch, list):
+                aggregator.handle_batch([a for a in batch if isinstance(a, dict)])
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class LogAggregator:
+    """
+    Aggregator side: owns the logger's handlers and writes what workers send.
+
+    Args:
+        address: Socket path (created with mode 0600, replacing a stale
+            one) or (host, port); TCP has no authentication, so it should
+            only listen on localhost
+        name: Logger name; configured with setup_logger(name, **setup_kwargs)
+        setup_kwargs: log_dir, enable_remote, compress_rotated, ... as for
+            setup_logger
+    """
+
+    def __init__(self, address: Address, name: str = 'app', **setup_kwargs):
+        self.address = address
+        self.logger = setup_logger(name, **setup_kwargs)
+        self.received = 0
+        self._count_lock = threading.Lock()
+
+        listener = _listeners.get(name)
+        for handler in (listener.handlers if listener else self.logger.handlers):
+            if isinstance(handler.formatter, StructuredFormatter):
+                handler.setFormatter(_PreformattedFormatter(handler.formatter))
+
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.unlink(address)
+            # Bind under a umask so the socket is never reachable by others,
+            # not even between bind and a chmod
+            umask = os.umask(0o177)
+            try:
+                self.server = _UnixServer(address, _BatchHandler)
+            finally:
+                os.umask(umask)
+        else:
+            self.server = _TCPServer(address, _BatchHandler)
+            self.address = self.server.server_address
+        self.server.aggregator = self
+
+    def handle_batch(self, batch: List[Dict[str, Any]]):
+        # logger.handle skips the level check; workers already made it.
+        # The attributes are complete, so LogRecord.__init__ (pid, thread
+        # and time lookups makeLogRecord would redo) is skipped.
+        handle = self.logger.handle
+        new_record = logging.LogRecord.__new__
+        for attributes in batch:
+            record = new_record(logging.LogRecord)
+            record.__dict__ = attributes
+            handle(record)
+        with self._count_lock:
+            self.received += len(batch)
+
+    def serve_forever(self):
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if isinstance(self.address, str) and os.path.exists(self.address):
+                os.unlink(self.address)
+
+    def shutdown(self):
+        """Stop serving; safe to call from a signal handler."""
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+
+def _serve(address: Address, name: str, setup_kwargs: Dict[str, Any]):
+    aggregator = LogAggregator(address, name, **setup_kwargs)
+    signal.signal(signal.SIGTERM, lambda signum, frame: aggregator.shutdown())
+    signal.signal(signal.SIGINT, lambda signum, frame: aggregator.shutdown())
+    aggregator.serve_forever()
+    logging.shutdown()
+
+
+def start_aggregator(address: Address, name: str = 'app', timeout: float = 10.0,
+                     **setup_kwargs) -> multiprocessing.Process:
+    """
+    Run a LogAggregator in a child process and return once it accepts
+    connections. Stop it with process.terminate() after the workers.
+    """
+    process = multiprocessing.Process(
+        target=_serve, args=(address, name, setup_kwargs), name=f'log-aggregator-{name}', daemon=False
+    )
+    process.start()
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _connect(address, timeout=1.0).close()
+            return process
+        except OSError:
+            if not process.is_alive() or time.monotonic() > deadline:
+                process.terminate()
+                raise RuntimeError(f"log aggregator did not start listening on {address!r}")
+            time.sleep(0.02)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Collect log records from worker processes.')
+    parser.add_argument('address', help='Unix socket path, or host:port for TCP')
+    parser.add_argument('--name', default='app')
+    parser.add_argument('--log-level', default='INFO')
+    parser.add_argument('--log-dir')
+    parser.add_argument('--enable-remote', action='store_true')
+    parser.add_argument('--remote-spool-dir')
+    parser.add_argument('--compress-rotated', action='store_true')
+    args = parser.parse_args(argv)
+
+    _serve(parse_address(args.address), args.name, {
+        'log_level': args.log_level,
+        'log_dir': args.log_dir,
+        'enable_remote': args.enable_remote,
+        'remote_spool_dir': args.remote_spool_dir,
+        'compress_rotated': args.compress_rotated
+    })
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
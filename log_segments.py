@@ -0,0 +1,386 @@
+"""
+Compressed, indexed log segments and a query tool for them.
+
+A segment holds a rotated JSON-lines log file as a series of independent
+gzip blocks followed by an index: for every block its byte range, the
+timestamp range and levels it contains, and a Bloom filter over its
+request_id and user_id values. A query reads only the index and then
+decompresses just the blocks that can match, instead of scanning the
+whole file. The index is stored as a trailer in the segment file itself,
+so rotation renames and deletes never separate the two.
+
+setup_logger(compress_rotated=True) installs handlers that turn each
+rotated file into a segment in a background thread. Existing files can be
+converted and any log directory searched from the command line:
+
+    python log_segments.py compress logs/app.log.1 logs/app_error.log.2024-01-31
+    python log_segments.py query logs --request-id abc123 --since 2024-01-31T10:00
+    python log_segments.py index logs/app.log.1.lseg
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import struct
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+
+SEGMENT_SUFFIX = '.lseg'
+MAGIC = b'LSEGIDX1'
+TRAILER = struct.Struct('>Q8s')
+
+BLOCK_LINES = 2000
+BLOOM_BITS = 8192
+BLOOM_HASHES = 4
+
+# Fields whose values go into each block's Bloom filter
+INDEXED_FIELDS = ('request_id', 'user_id')
+
+
+def _bloom_positions(field: str, value: Any) -> List[int]:
+    digest = hashlib.blake2b(f'{field}={value}'.encode(), digest_size=4 * BLOOM_HASHES).digest()
+    return [
+        int.from_bytes(digest[i * 4:(i + 1) * 4], 'big') % BLOOM_BITS
+        for i in range(BLOOM_HASHES)
+    ]
+
+
+class _Block:
+    """Accumulates one block's lines and index entry."""
+
+    def __init__(self):
+        self.lines: List[bytes] = []
+        self.ts_min: Optional[str] = None
+        self.ts_max: Optional[str] = None
+        self.levels = set()
+        self.bloom = bytearray(BLOOM_BITS // 8)
+
+    def add(self, line: bytes):
+        self.lines.append(line)
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return
+        if not isinstance(entry, dict):
+            return
+
+        timestamp = entry.get('timestamp')
+        if isinstance(timestamp, str):
+            if self.ts_min is None or timestamp < self.ts_min:
+                self.ts_min = timestamp
+            if self.ts_max is None or timestamp > self.ts_max:
+                self.ts_max = timestamp
+        if 'level' in entry:
+            self.levels.add(entry['level'])
+        for field in INDEXED_FIELDS:
+            if entry.get(field) is not None:
+                for bit in _bloom_positions(field, entry[field]):
+                    self.bloom[bit // 8] |= 1 << (bit % 8)
+
+    def write(self, out) -> Dict[str, Any]:
+        offset = out.tell()
+        out.write(gzip.compress(b''.join(self.lines), compresslevel=6))
+        return {
+            'offset': offset,
+            'length': out.tell() - offset,
+            'lines': len(self.lines),
+            'ts_min': self.ts_min,
+            'ts_max': self.ts_max,
+            'levels': sorted(self.levels),
+            'bloom': self.bloom.hex()
+        }
+
+
+def compress_file(source: Union[str, Path], dest: Optional[Union[str, Path]] = None,
+                  block_lines: int = BLOCK_LINES) -> Path:
+    """
+    Write `source` (JSON lines) as a segment to `dest` and return its path.
+
+    dest defaults to source + '.lseg'; when dest is source itself the
+    file is replaced in place. The source is removed otherwise.
+    """
+    source = Path(source)
+    dest = Path(dest) if dest else source.with_name(source.name + SEGMENT_SUFFIX)
+    tmp = dest.with_name(dest.name + '.tmp')
+
+    blocks = []
+    with open(source, 'rb') as src, open(tmp, 'wb') as out:
+        block = _Block()
+        for line in src:
+            if not line.endswith(b'\n'):
+                line += b'\n'
+            block.add(line)
+            if len(block.lines) >= block_lines:
+                blocks.append(block.write(out))
+                block = _Block()
+        if block.lines:
+            blocks.append(block.write(out))
+
+        index = json.dumps({
+            'version': 1,
+            'lines': sum(entry['lines'] for entry in blocks),
+            'ts_min': min((b['ts_min'] for b in blocks if b['ts_min']), default=None),
+            'ts_max': max((b['ts_max'] for b in blocks if b['ts_max']), default=None),
+            'blocks': blocks
+        }).encode()
+        out.write(index)
+        out.write(TRAILER.pack(len(index), MAGIC))
+        out.flush()
+        os.fsync(out.fileno())
+
+    os.replace(tmp, dest)
+    if dest != source:
+        source.unlink()
+    return dest
+
+
+def read_index(path: Union[str, Path]) -> Optional[Dict[str, Any]]:
+    """The segment's index, or None if the file is not (yet) a segment."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size < TRAILER.size:
+            return None
+        f.seek(size - TRAILER.size)
+        length, magic = TRAILER.unpack(f.read(TRAILER.size))
+        if magic != MAGIC or length > size - TRAILER.size:
+            return None
+        f.seek(size - TRAILER.size - length)
+        return json.loads(f.read(length))
+
+
+def _to_iso(value: Optional[Union[str, datetime]]) -> Optional[str]:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _block_may_match(block: Dict[str, Any], since: Optional[str], until: Optional[str],
+                     levels: Optional[set], terms: Dict[str, Any]) -> bool:
+    if since and block['ts_max'] and block['ts_max'] < since:
+        return False
+    if until and block['ts_min'] and block['ts_min'] >= until:
+        return False
+    if levels and not levels.intersection(block['levels']):
+        return False
+    if terms:
+        bloom = bytes.fromhex(block['bloom'])
+        for field, value in terms.items():
+            if not all(bloom[bit // 8] & (1 << (bit % 8)) for bit in _bloom_positions(field, value)):
+                return False
+    return True
+
+
+def _entry_matches(entry: Dict[str, Any], since: Optional[str], until: Optional[str],
+                   levels: Optional[set], terms: Dict[str, Any], contains: Optional[str]) -> bool:
+    timestamp = entry.get('timestamp') or ''
+    if since and timestamp < since:
+        return False
+    if until and timestamp >= until:
+        return False
+    if levels and entry.get('level') not in levels:
+        return False
+    for field, value in terms.items():
+        if str(entry.get(field)) != str(value):
+            return False
+    if contains and contains not in entry.get('message', ''):
+        return False
+    return True
+
+
+def _parse(lines: Iterable[bytes]) -> Iterator[Dict[str, Any]]:
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(entry, dict):
+            yield entry
+
+
+def _log_files(paths: Iterable[Union[str, Path]]) -> List[Path]:
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files += [p for p in path.iterdir() if p.is_file() and (p.suffix in ('.log', SEGMENT_SUFFIX) or '.log.' in p.name)]
+        else:
+            files.append(path)
+    return sorted(set(files), key=lambda p: p.stat().st_mtime)
+
+
+def query(
+    paths: Union[str, Path, Iterable[Union[str, Path]]],
+    request_id: Optional[str] = None,
+    user_id: Optional[Any] = None,
+    level: Optional[Union[str, Iterable[str]]] = None,
+    since: Optional[Union[str, datetime]] = None,
+    until: Optional[Union[str, datetime]] = None,
+    contains: Optional[str] = None,
+    limit: Optional[int] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield log entries matching every given condition, oldest file first.
+
+    `paths` are log directories or files. Segments are searched through
+    their indexes; plain JSON-lines files (the active log, rotated files
+    not compressed yet) are scanned. since/until are UTC ISO timestamps
+    or naive UTC datetimes, since inclusive and until exclusive.
+    """
+    if isinstance(paths, (str, Path)):
+        paths = [paths]
+    since, until = _to_iso(since), _to_iso(until)
+    levels = {level.upper()} if isinstance(level, str) else ({l.upper() for l in level} if level else None)
+    terms = {field: value for field, value in (('request_id', request_id), ('user_id', user_id)) if value is not None}
+
+    found = 0
+    for path in _log_files(paths):
+        index = read_index(path)
+        if index is None:
+            with open(path, 'rb') as f:
+                entries = _parse(f)
+                for entry in entries:
+                    if _entry_matches(entry, since, until, levels, terms, contains):
+                        yield entry
+                        found += 1
+                        if limit is not None and found >= limit:
+                            return
+            continue
+
+        if since and index['ts_max'] and index['ts_max'] < since:
+            continue
+        if until and index['ts_min'] and index['ts_min'] >= until:
+            continue
+
+        with open(path, 'rb') as f:
+            for block in index['blocks']:
+                if not _block_may_match(block, since, until, levels, terms):
+                    continue
+                f.seek(block['offset'])
+                data = gzip.decompress(f.read(block['length']))
+                for entry in _parse(data.splitlines()):
+                    if _entry_matches(entry, since, until, levels, terms, contains):
+                        yield entry
+                        found += 1
+                        if limit is not None and found >= limit:
+                            return
+
+
+class SegmentCompressor:
+    """
+    Rotator for logging's rotating handlers.
+
+    Moves the full file to its rotated name, as the default rotator does,
+    then converts it into a segment in place on a background thread. The
+    rotated name already carries SEGMENT_SUFFIX (see namer), so the
+    handler's own renaming and deletion of backups works unchanged.
+    """
+
+    def __init__(self, block_lines: int = BLOCK_LINES):
+        self.block_lines = block_lines
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='log-segment')
+        self._pending: List[Future] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def namer(name: str) -> str:
+        return name + SEGMENT_SUFFIX
+
+    def __call__(self, source: str, dest: str):
+        os.replace(source, dest)
+        with self._lock:
+            self._pending = [future for future in self._pending if not future.done()]
+            self._pending.append(self._executor.submit(compress_file, dest, dest, self.block_lines))
+
+    def wait(self):
+        """Block until every scheduled compression has finished."""
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.result()
+
+
+class _CompressingRollover:
+    """
+    Waits for earlier compressions before rolling over, so backups are
+    never renamed or deleted while a segment is being written over them.
+    """
+
+    def _install_compressor(self, compressor: Optional[SegmentCompressor]):
+        self.compressor = compressor or SegmentCompressor()
+        self.rotator = self.compressor
+        self.namer = self.compressor.namer
+
+    def doRollover(self):
+        self.compressor.wait()
+        super().doRollover()
+
+
+class SegmentRotatingFileHandler(_CompressingRollover, RotatingFileHandler):
+    def __init__(self, *args, compressor: Optional[SegmentCompressor] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._install_compressor(compressor)
+
+
+class SegmentTimedRotatingFileHandler(_CompressingRollover, TimedRotatingFileHandler):
+    def __init__(self, *args, compressor: Optional[SegmentCompressor] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._install_compressor(compressor)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Compress and query JSON-lines log segments.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    compress = commands.add_parser('compress', help='Turn rotated log files into indexed segments')
+    compress.add_argument('files', nargs='+')
+    compress.add_argument('--block-lines', type=int, default=BLOCK_LINES)
+
+    search = commands.add_parser('query', help='Print matching entries as JSON lines')
+    search.add_argument('paths', nargs='+', help='Log directories or files')
+    search.add_argument('--request-id')
+    search.add_argument('--user-id')
+    search.add_argument('--level', action='append', help='May be given more than once')
+    search.add_argument('--since', help='UTC ISO timestamp, inclusive')
+    search.add_argument('--until', help='UTC ISO timestamp, exclusive')
+    search.add_argument('--contains', help='Substring of the message')
+    search.add_argument('--limit', type=int)
+
+    show = commands.add_parser('index', help="Summarize a segment's index")
+    show.add_argument('files', nargs='+')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'compress':
+        for name in args.files:
+            print(compress_file(name, block_lines=args.block_lines))
+    elif args.command == 'query':
+        for entry in query(args.paths, request_id=args.request_id, user_id=args.user_id, level=args.level,
+                           since=args.since, until=args.until, contains=args.contains, limit=args.limit):
+            print(json.dumps(entry))
+    else:
+        for name in args.files:
+            index = read_index(name)
+            if index is None:
+                print(f"{name}: not a segment", file=sys.stderr)
+                continue
+            print(json.dumps({
+                'file': name,
+                'lines': index['lines'],
+                'blocks': len(index['blocks']),
+                'ts_min': index['ts_min'],
+                'ts_max': index['ts_max'],
+                'bytes': os.path.getsize(name)
+            }))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""
+Disk-backed write-ahead spool for remote log shipping.
+
+Entries are appended as JSON lines to numbered segment files in a
+directory. A reader takes batches from the acknowledged position on and
+acknowledges them once they have been delivered; the position is saved
+atomically next to the segments and fully delivered segments are deleted.
+Undelivered entries therefore survive outages and restarts, giving
+at-least-once delivery with memory use independent of the backlog.
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Tuple, Union
+
+
+SEGMENT_SUFFIX = '.seg'
+ACK_FILE = 'ack.json'
+
+# (segment number, byte offset) of the next entry to deliver
+Cursor = Tuple[int, int]
+
+
+class LogSpool:
+    """
+    Segmented append-only spool directory.
+
+    Args:
+        directory: Where segments and the ack position are kept
+        segment_bytes: A new segment is started once the current one is
+            this large
+        max_bytes: Total size cap; beyond it the oldest segments are
+            deleted and their entries counted in `dropped`
+        fsync: fsync every append (survives power loss, not just crashes)
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        segment_bytes: int = 4 * 1024 * 1024,
+        max_bytes: int = 256 * 1024 * 1024,
+        fsync: bool = False
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+        self._cursor = self._load_cursor()
+        segments = self._segments()
+        if not segments and self._cursor[1]:
+            # Segments were removed by hand; start the current one afresh
+            self._save_cursor((self._cursor[0], 0))
+        self._segment = segments[-1] if segments else self._cursor[0]
+        self._repair(self._segment)
+        self._file = open(self._path(self._segment), 'ab')
+
+    def _path(self, segment: int) -> Path:
+        return self.directory / f'{segment:012d}{SEGMENT_SUFFIX}'
+
+    def _segments(self) -> List[int]:
+        return sorted(int(path.stem) for path in self.directory.glob(f'*{SEGMENT_SUFFIX}'))
+
+    def _load_cursor(self) -> Cursor:
+        try:
+            with open(self.directory / ACK_FILE) as f:
+                data = json.load(f)
+            return data['segment'], data['offset']
+        except (OSError, ValueError, KeyError):
+            segments = self._segments()
+            return (segments[0] if segments else 0), 0
+
+    def _repair(self, segment: int):
+        """Cut a torn last line left by a crash mid-append."""
+        path = self._path(segment)
+        if not path.exists():
+            return
+        with open(path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                f.truncate(end)
+
+    def append(self, entry: Dict[str, Any]):
+        line = json.dumps(entry).encode() + b'\n'
+        with self._lock:
+            if self._file.tell() >= self.segment_bytes:
+                self._rotate()
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def _rotate(self):
+        self._file.close()
+        self._segment += 1
+        self._file = open(self._path(self._segment), 'ab')
+
+        segments = self._segments()
+        total = sum(self._path(segment).stat().st_size for segment in segments)
+        for segment in segments[:-1]:
+            if total <= self.max_bytes:
+                break
+            path = self._path(segment)
+            size = path.stat().st_size
+            with open(path, 'rb') as f:
+                if segment == self._cursor[0]:
+                    f.seek(self._cursor[1])
+                self.dropped += sum(1 for _ in f)
+            path.unlink()
+            total -= size
+            if self._cursor[0] <= segment:
+                self._save_cursor((segment + 1, 0))
+
+    def read(self, max_entries: int) -> Tuple[List[Dict[str, Any]], Cursor]:
+        """
+        Return up to max_entries undelivered entries and the cursor that
+        acknowledges them. Reading alone does not advance anything.
+        """
+        with self._lock:
+            segment, offset = self._cursor
+            last = self._segment
+
+        entries: List[Dict[str, Any]] = []
+        while len(entries) < max_entries and segment <= last:
+            try:
+                f = open(self._path(segment), 'rb')
+            except FileNotFoundError:
+                segment, offset = segment + 1, 0
+                continue
+            with f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    entries.append(json.loads(line))
+                    offset += len(line)
+                    if len(entries) == max_entries:
+                        break
+            if len(entries) < max_entries and segment < last:
+                segment, offset = segment + 1, 0
+            else:
+                break
+
+        return entries, (segment, offset)
+
+    def ack(self, cursor: Cursor):
+        """Mark everything before `cursor` delivered and delete spent segments."""
+        with self._lock:
+            if cursor <= self._cursor:
+                # Already past it, e.g. the segment was dropped over the cap
+                return
+            self._save_cursor(cursor)
+            for segment in self._segments():
+                if segment >= cursor[0]:
+                    break
+                self._path(segment).unlink(missing_ok=True)
+
+    def _save_cursor(self, cursor: Cursor):
+        self._cursor = cursor
+        tmp = self.directory / f'{ACK_FILE}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'segment': cursor[0], 'offset': cursor[1]}, f)
+        os.replace(tmp, self.directory / ACK_FILE)
+
+    def pending(self) -> bool:
+        """Whether any entry is waiting to be delivered."""
+        with self._lock:
+            segment, offset = self._cursor
+            if segment < self._segment:
+                return True
+            return self._file.tell() > offset
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -1,28 +1,114 @@
 """
 Logging utility module for application monitoring and debugging.
 Provides structured logging with multiple handlers and formatters.
+
+Importing the module has no side effects: `default_logger` is set up on
+first use, from DEFAULT_LOGGER_CONFIG, the APP_LOG_* environment variables
+and configure_default_logger().
 """
 
+import atexit
+import bisect
+import contextvars
+import copy
+import functools
+import gzip
+import inspect
 import logging
+import queue
+import random
 import sys
-from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
+import threading
+import weakref
+from collections import OrderedDict, deque
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
 import json
+from json.encoder import c_make_encoder, encode_basestring
+import math
+import os
+import time
 import traceback
-import requests
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, List
+
+from log_spool import LogSpool
+
+
+# What a full queue does with a new record in queued mode
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'drop_new')
+
+
+# Record attributes StructuredFormatter copies into the output when present
+DEFAULT_EXTRA_FIELDS = ('user_id', 'request_id', 'suppressed')
+
+
+def _json_backend():
+    """
+    orjson when it is installed, otherwise the standard library. Both write
+    compact JSON with non-ASCII text as is, and str() anything else, so a
+    line is the same whichever backend wrote it.
+    """
+    try:
+        import orjson
+    except ImportError:
+        return _stdlib_dumps()
+    
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+    return lambda data: orjson.dumps(data, default=str, option=options).decode()
+
+
+def _stdlib_dumps():
+    """
+    The json module's C encoder, built once: JSONEncoder.encode builds a
+    new one on every call. Without the circular-reference check, which
+    keeps its bookkeeping on the encoder and so cannot be shared by threads.
+    """
+    if c_make_encoder is None:
+        return json.JSONEncoder(default=str, ensure_ascii=False, separators=(',', ':')).encode
+    
+    encoder = c_make_encoder(None, str, encode_basestring, None, ':', ',', False, False, True)
+    return lambda data: ''.join(encoder(data, 0))
 
 
 class StructuredFormatter(logging.Formatter):
     """
     Custom formatter that outputs JSON structured logs.
     Useful for log aggregation systems like ELK, Splunk, etc.
+    
+    Timestamps come from record.created (UTC); the date-time part is
+    formatted once per second and reused. Fields of the log_context the
+    record was logged in are included (never in place of the fields
+    above), as are the record attributes named in extra_fields;
+    static_fields (service name, host, ...) are added to every line,
+    encoded once up front.
     """
     
+    def __init__(
+        self,
+        extra_fields: Optional[tuple] = DEFAULT_EXTRA_FIELDS,
+        static_fields: Optional[Dict[str, Any]] = None
+    ):
+        super().__init__()
+        self.extra_fields = tuple(extra_fields or ())
+        self.static_fields = dict(static_fields or {})
+        self._dumps = _json_backend()
+        # ',"service":"api",...' spliced in before the closing brace
+        self._static_json = self._dumps(self.static_fields)[1:-1]
+        # (second, formatted) swapped as one tuple so threads never mix them
+        self._second = (None, '')
+    
+    def _timestamp(self, created: float) -> str:
+        second = int(created)
+        cached_second, prefix = self._second
+        if second != cached_second:
+            prefix = datetime.fromtimestamp(second, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.')
+            self._second = (second, prefix)
+        return '%s%06d' % (prefix, (created - second) * 1_000_000)
+    
     def format(self, record: logging.LogRecord) -> str:
         log_data = {
-            'timestamp': datetime.utcnow().isoformat(),
+            'timestamp': self._timestamp(record.created),
             'level': record.levelname,
             'logger': record.name,
             'message': record.getMessage(),
@@ -39,26 +125,96 @@ class StructuredFormatter(logging.Formatter):
             }
         
         # Add custom fields if present
-        if hasattr(record, 'user_id'):
-            log_data['user_id'] = record.user_id
-        if hasattr(record, 'request_id'):
-            log_data['request_id'] = record.request_id
+        attributes = record.__dict__
+        # Set by LogContextFilter; otherwise this is the logging thread
+        context = attributes.get('log_context')
+        if context is None:
+            context = _log_context.get()
+        if context:
+            for key, value in context.items():
+                if key not in log_data:
+                    log_data[key] = value
+        for field in self.extra_fields:
+            if field in attributes:
+                log_data[field] = attributes[field]
         
-        return json.dumps(log_data)
+        if not self.static_fields:
+            return self._dumps(log_data)
+        if self.static_fields.keys().isdisjoint(log_data):
+            return f"{self._dumps(log_data)[:-1]},{self._static_json}}}"
+        log_data.update(self.static_fields)
+        return self._dumps(log_data)
 
 
 class RemoteLogHandler(logging.Handler):
     """
     Handler that sends critical logs to remote monitoring service.
-    Batches logs and sends them asynchronously to avoid blocking.
+    
+    Records are buffered and sent by a background thread, never on the
+    logging thread: a batch goes out as soon as batch_size records are
+    waiting, or after flush_interval seconds otherwise. Payloads are gzip
+    compressed and sent over one keep-alive session, with exponential
+    backoff between retries. At most max_buffer records are held; beyond
+    that the oldest are dropped and counted in `dropped`.
+    
+    With spool_dir, records are written to a LogSpool on disk instead of
+    the in-memory buffer and only acknowledged there once the service has
+    accepted them, so outages and restarts lose nothing (delivery is
+    at-least-once) while memory stays flat. spool_max_bytes caps the disk
+    used during a long outage.
+    
+    close() takes at most close_timeout seconds: it makes one last attempt
+    at what is still waiting, without retries. What that does not deliver
+    stays in the spool for the next run, or without a spool is counted in
+    `dropped`.
     """
     
-    def __init__(self, api_key: str, batch_size: int = 10,service_url=None):
+    def __init__(
+        self,
+        api_key: str,
+        batch_size: int = 10,
+        service_url=None,
+        flush_interval: float = 5.0,
+        max_buffer: int = 10000,
+        compress: bool = True,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        timeout: float = 5,
+        spool_dir: Optional[Path] = None,
+        spool_max_bytes: int = 256 * 1024 * 1024,
+        close_timeout: float = 1.0
+    ):
         super().__init__()
         self.service_url = service_url or "belogs.mutevazipeynircilik.com"
         self.api_key = api_key
         self.batch_size = batch_size
-        self.log_batch = []
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.compress = compress
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.close_timeout = close_timeout
+        self.log_batch: deque = deque()
+        self.stats = {'sent': 0, 'dropped': 0, 'failed_sends': 0}
+        self._buffer_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closing = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._session = None
+        
+        self.spool: Optional[LogSpool] = None
+        self._spooled = 0
+        if spool_dir:
+            self.spool = LogSpool(spool_dir, max_bytes=spool_max_bytes)
+            if self.spool.pending():
+                # Ship what an earlier run left behind
+                self._ensure_flusher()
+    
+    @property
+    def dropped(self) -> int:
+        return self.stats['dropped'] + (self.spool.dropped if self.spool else 0)
         
     def emit(self, record: logging.LogRecord):
         """
@@ -73,42 +229,474 @@ class RemoteLogHandler(logging.Handler):
                 'source': 'application'
             }
             
-            self.log_batch.append(log_entry)
+            if self.spool is not None:
+                self.spool.append(log_entry)
+                with self._buffer_lock:
+                    self._spooled += 1
+                    full = self._spooled >= self.batch_size
+            else:
+                with self._buffer_lock:
+                    self.log_batch.append(log_entry)
+                    self._enforce_cap()
+                    full = len(self.log_batch) >= self.batch_size
             
-            if len(self.log_batch) >= self.batch_size:
-                self._flush_logs()
+            self._ensure_flusher()
+            if full:
+                self._wakeup.set()
+    
+    def _enforce_cap(self):
+        overflow = len(self.log_batch) - self.max_buffer
+        for _ in range(max(0, overflow)):
+            self.log_batch.popleft()
+        self.stats['dropped'] += max(0, overflow)
     
-    def _flush_logs(self):
-        """Send accumulated logs to remote monitoring service."""
-        if not self.log_batch:
+    def _ensure_flusher(self):
+        if self._thread is None and not self._closing.is_set():
+            with self._buffer_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='remote-log-flusher', daemon=True)
+                    self._thread.start()
+    
+    def _run(self):
+        while not self._closing.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._flush_logs()
+    
+    def _flush_logs(self, deadline: Optional[float] = None):
+        """
+        Send accumulated logs to remote monitoring service; with a
+        deadline (time.monotonic()), give up on whatever is left by then.
+        """
+        wait = -1 if deadline is None else max(0.0, deadline - time.monotonic())
+        if not self._send_lock.acquire(timeout=wait):
             return
-        
         try:
-            response = requests.post(
-                f"{self.service_url}/api/v1/logs",
-                json={'logs': self.log_batch},
-                headers={
-                    'Authorization': f'Bearer {self.api_key}',
-                    'Content-Type': 'application/json'
-                },
-                timeout=5
-            )
+            if self.spool is not None:
+                self._ship_spool(deadline)
+            else:
+                self._ship_buffer(deadline)
+        finally:
+            self._send_lock.release()
+    
+    def _ship_buffer(self, deadline: Optional[float]):
+        while True:
+            with self._buffer_lock:
+                batch = [self.log_batch.popleft() for _ in range(min(self.batch_size, len(self.log_batch)))]
+            if not batch:
+                return
+            
+            if not self._send(batch, deadline):
+                with self._buffer_lock:
+                    if self._closing.is_set():
+                        # This was its last attempt
+                        self.stats['dropped'] += len(batch)
+                    else:
+                        # Keep logs for the next flush, ahead of newer ones
+                        self.log_batch.extendleft(reversed(batch))
+                        self._enforce_cap()
+                return
+    
+    def _ship_spool(self, deadline: Optional[float]):
+        """Send spooled entries in order, acknowledging each accepted batch."""
+        with self._buffer_lock:
+            self._spooled = 0
+        while True:
+            batch, cursor = self.spool.read(self.batch_size)
+            if not batch or not self._send(batch, deadline):
+                return
+            self.spool.ack(cursor)
+    
+    def _get_session(self):
+        if self._session is None:
+            # Imported here so only processes that ship logs pay for it
+            import requests
+            self._session = requests.Session()
+            self._session.headers.update({
+                'Authorization': f'Bearer {self.api_key}',
+                'Content-Type': 'application/json'
+            })
+        return self._session
+    
+    def _send(self, batch: List[Dict[str, Any]], deadline: Optional[float] = None) -> bool:
+        """
+        POST one batch, retrying until the handler starts closing; False
+        when it was not delivered.
+        """
+        body = json.dumps({'logs': batch}).encode()
+        headers = {}
+        if self.compress:
+            body = gzip.compress(body, compresslevel=5)
+            headers['Content-Encoding'] = 'gzip'
+        
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                # Cut short on close so the final flush isn't held up
+                if self._closing.wait(min(30.0, self.backoff * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)):
+                    return False
+            
+            timeout = self.timeout
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    return False
+            
+            try:
+                response = self._get_session().post(
+                    f"{self.service_url}/api/v1/logs",
+                    data=body,
+                    headers=headers,
+                    timeout=timeout
+                )
+            except Exception as e:
+                print(f"Error sending logs to remote service: {e}", file=sys.stderr)
+                self.stats['failed_sends'] += 1
+                continue
             
             if response.status_code == 200:
-                self.log_batch.clear()
+                self.stats['sent'] += len(batch)
+                return True
+            
+            print(f"Failed to send logs: {response.status_code}", file=sys.stderr)
+            self.stats['failed_sends'] += 1
+            if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+                # Rejected as malformed; resending the same batch can't help
+                self.stats['dropped'] += len(batch)
+                return True
+        
+        return False
+    
+    def flush(self):
+        """Send everything buffered now, on the calling thread."""
+        self._flush_logs()
+    
+    def close(self):
+        """Stop the flusher and try once more, within close_timeout, to send what is left."""
+        deadline = time.monotonic() + self.close_timeout
+        self._closing.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(self.close_timeout)
+        self._flush_logs(deadline)
+        with self._buffer_lock:
+            self.stats['dropped'] += len(self.log_batch)
+            self.log_batch.clear()
+        if self._session is not None:
+            self._session.close()
+        if self.spool is not None:
+            self.spool.close()
+        super().close()
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Hands records to a bounded queue instead of handling them in place.
+    
+    When the queue is full, 'block' waits for room, 'drop_new' discards
+    the incoming record and 'drop_oldest' discards the oldest queued one.
+    Discarded records are counted in `dropped`.
+    """
+    
+    def __init__(self, log_queue: queue.Queue, overflow: str = 'block'):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}, got {overflow!r}")
+        super().__init__(log_queue)
+        self.overflow = overflow
+        self.dropped = 0
+        self._drop_lock = threading.Lock()
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Merge args into the message so the record no longer references them.
+        
+        Formatting is left to the listener's handlers; exc_info is kept
+        because StructuredFormatter renders it itself.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+    
+    def enqueue(self, record: logging.LogRecord):
+        if self.overflow == 'block':
+            self.queue.put(record)
+            return
+        
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            if self.overflow == 'drop_new':
+                with self._drop_lock:
+                    self.dropped += 1
+                return
+        
+        with self._drop_lock:
+            while True:
+                try:
+                    self.queue.put_nowait(record)
+                    return
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+
+
+class _TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+    
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+    
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class _Template:
+    __slots__ = ('window_start', 'suppressed', 'last', 'bucket')
+    
+    def __init__(self, now: float, bucket: Optional[_TokenBucket]):
+        self.window_start = now
+        self.suppressed = 0
+        self.last: Optional[logging.LogRecord] = None
+        self.bucket = bucket
+
+
+# Every LogStormFilter, so shutdown_logging can report what they hold back
+_storm_filters: 'weakref.WeakSet[LogStormFilter]' = weakref.WeakSet()
+
+
+class LogStormFilter(logging.Filter):
+    """
+    Keeps log volume bounded when one code path starts repeating itself.
+    
+    Records are fingerprinted by logger, level and unformatted message
+    template. In order, a record is dropped when:
+        - its level has a sample rate below 1 and it loses the draw
+        - the same template already passed within dedup_window seconds
+        - its template's token bucket (template_rate per second, burst
+          template_burst) is empty
+        - its level's token bucket (level_rates {level: (rate, burst)}) is empty
+    
+    Deduplicated and rate-limited records are not lost silently: once a
+    template's window has passed, the next record of it carries
+    `suppressed`, the number held back, and says so in its message. If
+    none comes, a background sweep emits a summary record instead, as do
+    flush() and shutdown_logging(). Counters are in `stats`.
+    
+    Attach it to handlers rather than a logger, so records propagated from
+    child loggers are seen too. One filter can sit on several handlers:
+    each record is judged once, and the other handlers reuse the verdict.
+    
+    Args:
+        sample_rates: {level: fraction kept}, e.g. {logging.DEBUG: 0.01}
+        emit: Where flush() sends summaries of templates that went quiet;
+            setup_logger sets this to the logger's handle
+        max_templates: Templates tracked at once; the least recent go first
+    """
+    
+    def __init__(
+        self,
+        dedup_window: float = 1.0,
+        template_rate: Optional[float] = None,
+        template_burst: float = 10.0,
+        level_rates: Optional[Dict[int, tuple]] = None,
+        sample_rates: Optional[Dict[int, float]] = None,
+        emit: Optional[Callable[[logging.LogRecord], Any]] = None,
+        max_templates: int = 10000
+    ):
+        super().__init__()
+        self.dedup_window = dedup_window
+        self.template_rate = template_rate
+        self.template_burst = template_burst
+        self.level_buckets = {
+            level: _TokenBucket(rate, burst) for level, (rate, burst) in (level_rates or {}).items()
+        }
+        self.sample_rates = dict(sample_rates or {})
+        self.emit = emit
+        self.max_templates = max_templates
+        self.stats = {'passed': 0, 'sampled_out': 0, 'deduplicated': 0, 'rate_limited': 0}
+        self._templates: 'OrderedDict[tuple, _Template]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self._sweeper: Optional[threading.Thread] = None
+        # The record last judged on this thread and its verdict; a logger
+        # hands a record to its handlers one after another on one thread
+        self._verdict = threading.local()
+        _storm_filters.add(self)
+    
+    def _ensure_sweeper(self):
+        """Start the thread that reports suppressed records once a logger goes quiet."""
+        if self._sweeper is None and self.emit is not None:
+            self._sweeper = threading.Thread(target=self._sweep, name='log-storm-sweeper', daemon=True)
+            self._sweeper.start()
+    
+    def _sweep(self):
+        while True:
+            time.sleep(self.dedup_window)
+            with self._lock:
+                summaries = self._expired(time.monotonic())
+                idle = not any(template.suppressed for template in self._templates.values())
+                if idle:
+                    self._sweeper = None
+            for summary in summaries:
+                self.emit(summary)
+            if idle:
+                return
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, '_storm_summary', False):
+            return True
+        verdict = self._verdict
+        if getattr(verdict, 'record', None) is record:
+            return verdict.passed
+        
+        now = time.monotonic()
+        key = (record.name, record.levelno, record.msg if isinstance(record.msg, str) else type(record.msg))
+        rate = self.sample_rates.get(record.levelno)
+        summaries = []
+        
+        with self._lock:
+            if rate is not None and rate < 1.0 and random.random() >= rate:
+                self.stats['sampled_out'] += 1
+                passed = False
             else:
-                # Keep logs in batch for retry on next flush
-                print(f"Failed to send logs: {response.status_code}", file=sys.stderr)
-                
-        except Exception as e:
-            print(f"Error sending logs to remote service: {e}", file=sys.stderr)
+                passed = self._admit(record, key, now)
+            # Also report templates that went quiet, whether or not this record passed
+            if self.emit is not None and now - self._last_sweep >= self.dedup_window:
+                self._last_sweep = now
+                summaries = self._expired(now)
+        
+        verdict.record, verdict.passed = record, passed
+        for summary in summaries:
+            self.emit(summary)
+        return passed
+    
+    def _admit(self, record: logging.LogRecord, key: tuple, now: float) -> bool:
+        template = self._templates.get(key)
+        if template is None:
+            bucket = _TokenBucket(self.template_rate, self.template_burst) if self.template_rate else None
+            template = self._templates[key] = _Template(now, bucket)
+            if len(self._templates) > self.max_templates:
+                self._templates.popitem(last=False)
+        else:
+            self._templates.move_to_end(key)
+            if now - template.window_start < self.dedup_window:
+                template.suppressed += 1
+                template.last = record
+                self.stats['deduplicated'] += 1
+                self._ensure_sweeper()
+                return False
+        
+        level_bucket = self.level_buckets.get(record.levelno)
+        if (template.bucket and not template.bucket.take(now)) or (level_bucket and not level_bucket.take(now)):
+            template.suppressed += 1
+            template.last = record
+            self.stats['rate_limited'] += 1
+            self._ensure_sweeper()
+            return False
+        
+        template.window_start = now
+        if template.suppressed:
+            record.suppressed = template.suppressed
+            record.msg = f"{record.getMessage()} [{template.suppressed} similar records suppressed]"
+            record.args = None
+            template.suppressed = 0
+            template.last = None
+        self.stats['passed'] += 1
+        return True
+    
+    def _expired(self, now: float, force: bool = False) -> List[logging.LogRecord]:
+        """Summary records for templates with suppressed records whose window is over."""
+        summaries = []
+        for template in self._templates.values():
+            if template.suppressed and template.last is not None and (
+                    force or now - template.window_start >= self.dedup_window):
+                summary = copy.copy(template.last)
+                summary.msg = f"{summary.getMessage()} [{template.suppressed} similar records suppressed]"
+                summary.args = None
+                summary.suppressed = template.suppressed
+                summary._storm_summary = True
+                summaries.append(summary)
+                template.suppressed = 0
+                template.last = None
+                template.window_start = now
+        return summaries
+    
+    def flush(self):
+        """Emit summaries for every template still holding suppressed records."""
+        with self._lock:
+            summaries = self._expired(time.monotonic(), force=True)
+        if self.emit is not None:
+            for summary in summaries:
+                self.emit(summary)
+
+
+class _LogListener(QueueListener):
+    def enqueue_sentinel(self):
+        # Wait for room; put_nowait would fail on a full queue at shutdown
+        self.queue.put(self._sentinel)
+
+
+# Listeners of loggers set up with use_queue, by logger name
+_listeners: Dict[str, QueueListener] = {}
+# AggregatorHandlers of loggers set up with aggregator_address, by logger name
+_senders: Dict[str, logging.Handler] = {}
+_listeners_lock = threading.Lock()
+
+
+def _stop_listener(name: str):
+    with _listeners_lock:
+        listener = _listeners.pop(name, None)
+        sender = _senders.pop(name, None)
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+    if sender is not None:
+        # Sends whatever is still queued
+        sender.close()
+
+
+def shutdown_logging():
+    """
+    Drain every queued or aggregated logger and close its handlers.
+    
+    Registered with atexit, and run by multiprocessing workers on exit
+    once they have an AggregatorHandler, so records queued before exit
+    are written; call it directly before os._exit or similar.
+    """
+    for storm_filter in list(_storm_filters):
+        storm_filter.flush()
+    for name in set(_listeners) | set(_senders):
+        _stop_listener(name)
+
+
+atexit.register(shutdown_logging)
 
 
 def setup_logger(
     name: str = 'app',
     log_level: str = 'INFO',
     log_dir: Optional[Path] = None,
-    enable_remote: bool = False
+    enable_remote: bool = False,
+    remote_spool_dir: Optional[Path] = None,
+    use_queue: bool = False,
+    queue_size: int = 10000,
+    overflow: str = 'block',
+    storm_filter: Optional[LogStormFilter] = None,
+    compress_rotated: bool = False,
+    aggregator_address: Optional[Any] = None
 ) -> logging.Logger:
     """
     Configure and return a logger with multiple handlers.
@@ -118,6 +706,23 @@ def setup_logger(
         log_level: Minimum log level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
         log_dir: Directory for log files (default: ./logs)
         enable_remote: Whether to enable remote log monitoring
+        remote_spool_dir: Spool remote logs on disk here until delivered
+        use_queue: Log through a bounded queue; a background listener
+            thread owns all handlers, so callers never wait on file or
+            network I/O
+        queue_size: Capacity of the queue in queued mode
+        overflow: What to do when the queue is full: 'block', 'drop_oldest'
+            or 'drop_new'
+        storm_filter: LogStormFilter put on the logger's handlers (the
+            queue or aggregator handler when there is one), so it also
+            covers records propagated from child loggers
+        compress_rotated: Turn rotated log files into compressed, indexed
+            segments in the background (see log_segments)
+        aggregator_address: Socket path, (host, port) or 'host:port' of a
+            log_aggregator process; records are sent there instead, and the aggregator
+            owns the console, files, rotation and remote shipping. Use this
+            when several processes log to the same log_dir. queue_size and
+            overflow apply to the sending queue.
         
     Returns:
         Configured logger instance
@@ -125,8 +730,32 @@ def setup_logger(
     logger = logging.getLogger(name)
     logger.setLevel(getattr(logging, log_level.upper()))
     
-    # Remove existing handlers to avoid duplicates
-    logger.handlers.clear()
+    # Report what the old storm filters hold back while their handlers still exist
+    for storm in {f for handler in logger.handlers for f in handler.filters if isinstance(f, LogStormFilter)}:
+        storm.flush()
+    
+    # Remove existing handlers to avoid duplicates, closing their files,
+    # flusher threads and spools (queued mode: stop the listener first)
+    _stop_listener(name)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    if storm_filter is not None and storm_filter.emit is None:
+        storm_filter.emit = logger.handle
+    context_filter = LogContextFilter()
+    
+    if aggregator_address is not None:
+        from log_aggregator import AggregatorHandler
+        sender = AggregatorHandler(aggregator_address, queue_size=queue_size, overflow=overflow)
+        sender.addFilter(context_filter)
+        if storm_filter is not None:
+            sender.addFilter(storm_filter)
+        with _listeners_lock:
+            _senders[name] = sender
+        logger.addHandler(sender)
+        return logger
+    
+    handlers: List[logging.Handler] = []
     
     # Console handler with simple format
     console_handler = logging.StreamHandler(sys.stdout)
@@ -136,25 +765,30 @@ def setup_logger(
         datefmt='%Y-%m-%d %H:%M:%S'
     )
     console_handler.setFormatter(console_format)
-    logger.addHandler(console_handler)
+    handlers.append(console_handler)
     
     # File handler with rotation
     if log_dir:
         log_dir = Path(log_dir)
         log_dir.mkdir(parents=True, exist_ok=True)
+        if compress_rotated:
+            from log_segments import SegmentRotatingFileHandler, SegmentTimedRotatingFileHandler
+            size_handler_class, timed_handler_class = SegmentRotatingFileHandler, SegmentTimedRotatingFileHandler
+        else:
+            size_handler_class, timed_handler_class = RotatingFileHandler, TimedRotatingFileHandler
         
         # Rotating file handler (10MB per file, keep 5 backups)
-        file_handler = RotatingFileHandler(
+        file_handler = size_handler_class(
             log_dir / f'{name}.log',
             maxBytes=10 * 1024 * 1024,
             backupCount=5
         )
         file_handler.setLevel(logging.INFO)
         file_handler.setFormatter(StructuredFormatter())
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
         
         # Daily rotating handler for errors
-        error_handler = TimedRotatingFileHandler(
+        error_handler = timed_handler_class(
             log_dir / f'{name}_error.log',
             when='midnight',
             interval=1,
@@ -162,77 +796,416 @@ def setup_logger(
         )
         error_handler.setLevel(logging.ERROR)
         error_handler.setFormatter(StructuredFormatter())
-        logger.addHandler(error_handler)
+        handlers.append(error_handler)
     
     # Remote monitoring handler for production
     if enable_remote:
         remote_handler = RemoteLogHandler(
             service_url='https://logs.gs.com',
             api_key='', #deletion 17th commit 
-            batch_size=10
+            batch_size=10,
+            spool_dir=remote_spool_dir
         )
         remote_handler.setLevel(logging.ERROR)
-        logger.addHandler(remote_handler)
+        handlers.append(remote_handler)
+    
+    if use_queue:
+        queue_handler = BoundedQueueHandler(queue.Queue(maxsize=queue_size), overflow)
+        queue_handler.addFilter(context_filter)
+        if storm_filter is not None:
+            queue_handler.addFilter(storm_filter)
+        listener = _LogListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        with _listeners_lock:
+            _listeners[name] = listener
+        listener.start()
+        logger.addHandler(queue_handler)
+    else:
+        for handler in handlers:
+            handler.addFilter(context_filter)
+            if storm_filter is not None:
+                handler.addFilter(storm_filter)
+            logger.addHandler(handler)
     
     return logger
 
 
-def log_function_call(logger: logging.Logger):
+class LatencyHistogram:
     """
-    Decorator to automatically log function calls with arguments and results.
-    Useful for debugging and monitoring critical functions.
+    Call latencies in logarithmic buckets, each GROWTH times wider than
+    the one before, from 1µs up; percentiles are exact to within one
+    bucket (about 19%) in fixed memory.
+    """
+    
+    MIN_SECONDS = 1e-6
+    GROWTH = 2 ** 0.25
+    BUCKETS = 112  # up to ~4 minutes; slower calls share the last bucket
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        self.counts = [0] * self.BUCKETS
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def record(self, seconds: float, error: bool = False):
+        index = bisect.bisect_left(_LATENCY_BOUNDS, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.calls += 1
+            self.errors += error
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+    
+    def percentile(self, pct: float) -> float:
+        """Upper bound of the bucket holding the pct-th percentile, in seconds."""
+        rank = math.ceil(self.calls * pct / 100)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if index == self.BUCKETS - 1:
+                    return self.max
+                return min(self.max, _LATENCY_BOUNDS[index])
+        return self.max
+    
+    def summary(self, reset: bool = False) -> Dict[str, Any]:
+        with self._lock:
+            summary = {
+                'calls': self.calls,
+                'errors': self.errors,
+                'error_rate': round(self.errors / self.calls, 4) if self.calls else 0.0,
+                'mean_ms': round(self.total / self.calls * 1000, 3) if self.calls else 0.0,
+                'p50_ms': round(self.percentile(50) * 1000, 3),
+                'p95_ms': round(self.percentile(95) * 1000, 3),
+                'p99_ms': round(self.percentile(99) * 1000, 3),
+                'max_ms': round(self.max * 1000, 3)
+            }
+            if reset:
+                self.reset()
+        return summary
+
+
+# Upper bounds of all but the last LatencyHistogram bucket
+_LATENCY_BOUNDS = [
+    LatencyHistogram.MIN_SECONDS * LatencyHistogram.GROWTH ** i
+    for i in range(LatencyHistogram.BUCKETS - 1)
+]
+
+# Latency histograms of instrumented functions, by qualified name
+_histograms: Dict[str, LatencyHistogram] = {}
+_instrumentation_enabled = True
+
+
+def set_instrumentation(enabled: bool):
+    """Switch timing of @instrument functions on or off process-wide."""
+    global _instrumentation_enabled
+    _instrumentation_enabled = enabled
+
+
+def instrument(
+    logger: Optional[logging.Logger] = None,
+    name: Optional[str] = None,
+    sample_rate: float = 1.0,
+    log_calls: bool = False
+):
+    """
+    Decorator timing a sync or async function into a latency histogram.
+    
+    Args:
+        logger: Logger for call/return lines and exceptions (optional)
+        name: Histogram name (default: module.qualname)
+        sample_rate: Fraction of calls that are timed
+        log_calls: Log arguments and return values at DEBUG; they are
+            only formatted when DEBUG is enabled for the logger
+    
+    Exceptions are counted as errors and, with a logger, logged at ERROR
+    with the traceback before being re-raised. Summaries come from
+    instrumentation_summary() or an InstrumentationReporter.
     """
     def decorator(func):
+        label = name or f"{func.__module__}.{func.__qualname__}"
+        histogram = _histograms.setdefault(label, LatencyHistogram())
+        
+        verbose = log_calls and logger is not None
+        perf_counter = time.perf_counter
+        
+        def failed(started: float, error: Exception):
+            if started:
+                histogram.record(perf_counter() - started, True)
+            if logger is not None:
+                # stacklevel 3 attributes the line to the decorated function's caller
+                logger.error("%s raised exception: %s", label, error, exc_info=error, stacklevel=3)
+        
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                debug = verbose and logger.isEnabledFor(logging.DEBUG)
+                if debug:
+                    logger.debug("Calling %s with args=%r, kwargs=%r", label, args, kwargs, stacklevel=2)
+                started = perf_counter() if _instrumentation_enabled and (
+                    sample_rate >= 1.0 or random.random() < sample_rate) else 0.0
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception as e:
+                    failed(started, e)
+                    raise
+                if started:
+                    histogram.record(perf_counter() - started)
+                if debug:
+                    logger.debug("%s returned: %r", label, result, stacklevel=2)
+                return result
+            return async_wrapper
+        
+        @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            logger.debug(
-                f"Calling {func.__name__} with args={args}, kwargs={kwargs}"
-            )
+            debug = verbose and logger.isEnabledFor(logging.DEBUG)
+            if debug:
+                logger.debug("Calling %s with args=%r, kwargs=%r", label, args, kwargs, stacklevel=2)
+            started = perf_counter() if _instrumentation_enabled and (
+                sample_rate >= 1.0 or random.random() < sample_rate) else 0.0
             try:
                 result = func(*args, **kwargs)
-                logger.debug(f"{func.__name__} returned: {result}")
-                return result
             except Exception as e:
-                logger.error(
-                    f"{func.__name__} raised exception: {e}",
-                    exc_info=True
-                )
+                failed(started, e)
                 raise
+            if started:
+                histogram.record(perf_counter() - started)
+            if debug:
+                logger.debug("%s returned: %r", label, result, stacklevel=2)
+            return result
         return wrapper
     return decorator
 
 
+def instrumentation_summary(reset: bool = False) -> Dict[str, Dict[str, Any]]:
+    """Latency summary of every instrumented function that has been called."""
+    return {
+        label: histogram.summary(reset)
+        for label, histogram in list(_histograms.items())
+        if histogram.calls
+    }
+
+
+class InstrumentationReporter:
+    """
+    Logs a summary line per instrumented function every `interval` seconds.
+    
+    Each line carries the summary as log context fields (function_name,
+    calls, error_rate, p50_ms, ...), so StructuredFormatter writes them
+    as JSON fields. Histograms are reset after each report.
+    """
+    
+    def __init__(self, logger: logging.Logger, interval: float = 60.0):
+        self.logger = logger
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='instrumentation-reporter', daemon=True)
+    
+    def start(self) -> 'InstrumentationReporter':
+        self._thread.start()
+        return self
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+    
+    def report(self):
+        for label, summary in instrumentation_summary(reset=True).items():
+            with log_context(function_name=label, **summary):
+                self.logger.info(
+                    "%s: %d calls, p50 %.3fms, p99 %.3fms, error rate %.2f%%",
+                    label, summary['calls'], summary['p50_ms'], summary['p99_ms'], summary['error_rate'] * 100
+                )
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.report()
+
+
+def log_function_call(logger: logging.Logger):
+    """
+    Decorator to automatically log function calls with arguments and results.
+    Useful for debugging and monitoring critical functions.
+    
+    Same as instrument(logger, log_calls=True).
+    """
+    return instrument(logger, log_calls=True)
+
+
+# Fields of the active log_context; replaced, never mutated, so a record
+# can keep a reference to the mapping that was current when it was created
+_log_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar('log_context', default={})
+
+
+class log_context:
+    """
+    Attach fields to every record logged in the current context.
+    
+    Backed by contextvars, so concurrent asyncio tasks and threads each
+    see their own fields, and nested contexts add to the outer ones. Works
+    as a context manager and as a decorator (sync or async):
+    
+        with log_context(request_id='abc123', user_id=42):
+            logger.info('Processing request')
+        
+        @log_context(component='billing')
+        async def charge(...): ...
+    
+    StructuredFormatter writes them out. Handlers from setup_logger carry
+    them along as record.log_context (see LogContextFilter), so queued
+    and aggregated records keep them. Work handed to a thread pool needs
+    with_log_context(fn) to take the fields along.
+    """
+    
+    def __init__(self, **fields: Any):
+        self.fields = fields
+        self._tokens: List[contextvars.Token] = []
+    
+    def __enter__(self) -> 'log_context':
+        self._tokens.append(_log_context.set({**_log_context.get(), **self.fields}))
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _log_context.reset(self._tokens.pop())
+    
+    def __call__(self, func: Callable) -> Callable:
+        fields = self.fields
+        
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with log_context(**fields):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with log_context(**fields):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def get_log_context() -> Dict[str, Any]:
+    """Fields of the active log context (do not modify)."""
+    return _log_context.get()
+
+
+def with_log_context(func: Callable) -> Callable:
+    """
+    Bind func to the current context, e.g. before executor.submit().
+    
+    asyncio tasks and asyncio.to_thread copy the context by themselves;
+    ThreadPoolExecutor.submit and loop.run_in_executor do not.
+    """
+    context = contextvars.copy_context()
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.run(func, *args, **kwargs)
+    return wrapper
+
+
+class LogContextFilter(logging.Filter):
+    """
+    Stores the active log_context fields on each record as
+    record.log_context, for handlers that format records on another
+    thread or in another process. Passes every record.
+    """
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if 'log_context' not in record.__dict__:
+            record.log_context = _log_context.get()
+        return True
+
+
 def log_with_context(logger: logging.Logger, **context: Dict[str, Any]):
     """
     Add contextual information to log records.
     Useful for tracking requests across services.
     
+    Kept for existing callers; same as log_context(**context), which
+    applies to every logger, not just `logger`.
+    
     Example:
-        with log_context(logger, request_id='abc123', user_id=42):
+        with log_with_context(logger, request_id='abc123', user_id=42):
             logger.info('Processing request')
     """
-    class LogContext:
-        def __enter__(self):
-            self.old_factory = logging.getLogRecordFactory()
-            
-            def record_factory(*args, **kwargs):
-                record = self.old_factory(*args, **kwargs)
-                for key, value in context.items():
-                    setattr(record, key, value)
-                return record
-            
-            logging.setLogRecordFactory(record_factory)
-            return self
-        
-        def __exit__(self, exc_type, exc_val, exc_tb):
-            logging.setLogRecordFactory(self.old_factory)
+    return log_context(**context)
+
+
+# setup_logger arguments of the default logger unless configured otherwise
+DEFAULT_LOGGER_CONFIG: Dict[str, Any] = {
+    'name': 'application',
+    'log_level': 'INFO',
+    'log_dir': Path('./logs'),
+    'enable_remote': True
+}
+
+# Environment variables read when the default logger is built, and the
+# setup_logger argument each one sets. Unset or empty variables change
+# nothing; configure_default_logger(log_dir=None) turns log files off.
+DEFAULT_LOGGER_ENV = {
+    'APP_LOG_NAME': 'name',
+    'APP_LOG_LEVEL': 'log_level',
+    'APP_LOG_DIR': 'log_dir',
+    'APP_LOG_REMOTE': 'enable_remote',
+    'APP_LOG_REMOTE_SPOOL_DIR': 'remote_spool_dir',
+    'APP_LOG_QUEUE': 'use_queue',
+    'APP_LOG_COMPRESS_ROTATED': 'compress_rotated',
+    'APP_LOG_AGGREGATOR': 'aggregator_address'
+}
+
+_BOOLEAN_SETTINGS = ('enable_remote', 'use_queue', 'compress_rotated')
+
+_default_logger_config: Dict[str, Any] = {}
+_default_logger_lock = threading.Lock()
+
+
+def _default_logger_settings() -> Dict[str, Any]:
+    """DEFAULT_LOGGER_CONFIG, overridden by the environment, then by configure_default_logger."""
+    settings = dict(DEFAULT_LOGGER_CONFIG)
+    for variable, argument in DEFAULT_LOGGER_ENV.items():
+        value = os.environ.get(variable, '').strip()
+        if not value:
+            continue
+        if argument in _BOOLEAN_SETTINGS:
+            settings[argument] = value.lower() in ('1', 'true', 'yes', 'on')
+        else:
+            settings[argument] = value
+    settings.update(_default_logger_config)
+    return settings
+
+
+def configure_default_logger(config: Optional[Dict[str, Any]] = None, **settings: Any):
+    """
+    Set setup_logger arguments for default_logger.
     
-    return LogContext()
+    These take precedence over the APP_LOG_* environment variables. Called
+    before default_logger is first used, nothing is created until then;
+    called afterwards, the default logger is reconfigured in place.
+    
+    Example:
+        configure_default_logger(log_dir=None, enable_remote=False)
+    """
+    with _default_logger_lock:
+        _default_logger_config.update(config or {}, **settings)
+        if 'default_logger' in globals():
+            globals()['default_logger'] = setup_logger(**_default_logger_settings())
 
 
-# Default logger instance
-default_logger = setup_logger(
-    name='application',
-    log_level='INFO',
-    log_dir=Path('./logs'),
-    enable_remote=True
-)
+def __getattr__(name: str) -> Any:
+    # default_logger is built on first access instead of at import, so
+    # importing this module creates no directories, files or threads
+    if name == 'default_logger':
+        with _default_logger_lock:
+            if 'default_logger' not in globals():
+                globals()['default_logger'] = setup_logger(**_default_logger_settings())
+            return globals()['default_logger']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")